@@ -0,0 +1,227 @@
+#! python3
+"""This module implements an asyncio facade over the tournament and trivia
+file classes.  The file classes parse and write YAML synchronously, which is
+fine on the command line but stalls every other command (and the gateway
+heartbeat) when done inside a Discord Bot coroutine.  The facade pushes that
+work onto a bounded thread pool, serializes access per file, and keeps
+latency counters so the responsiveness of the event loop can be checked."""
+import asyncio
+import concurrent.futures
+import os
+import time
+
+
+################################################################################
+def create_executor(max_workers=4):
+    """Returns the bounded thread pool the facades share for file work."""
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="bb_io"
+    )
+
+
+################################################################################
+class LatencyCounter:
+    """Class accumulates the number of calls and the total and worst case
+    durations (in seconds) for a single operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        """Adds a single measured duration to the counter."""
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def mean(self):
+        """Average duration of the recorded calls."""
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def __str__(self):
+        return f"calls: {self.count:6} mean: {self.mean * 1000:8.3f} ms max: {self.max * 1000:8.3f} ms"
+
+
+################################################################################
+class AsyncFile:
+    """Base class for the facades.  Every call is handed to the thread pool
+    while holding a lock belonging to the underlying file, so reads and writes
+    of one file never interleave while different files proceed in parallel.
+    Two counters are kept per operation: 'wait' is the time spent queued
+    behind the lock and the pool, 'run' is the time spent doing the work."""
+
+    # One asyncio lock per absolute file name, shared by every facade object
+    # pointing at the same file.
+    _locks = {}
+
+    def __init__(self, wrapped, executor=None):
+        self.wrapped = wrapped
+        self.executor = executor or create_executor()
+        self.key = os.path.abspath(wrapped.filename)
+        self.wait = {}
+        self.run = {}
+        # Calls submitted and not finished yet, see close().
+        self.pending = 0
+        self.closing = False
+
+    @property
+    def lock(self):
+        """The lock serializing access to the underlying file.  Created on
+        first use so it belongs to the running event loop."""
+        if self.key not in AsyncFile._locks:
+            AsyncFile._locks[self.key] = asyncio.Lock()
+        return AsyncFile._locks[self.key]
+
+    async def call(self, name, func, *args, read_only=False):
+        """Runs func(*args) on the thread pool under the file lock and records
+        the latency counters under the given operation name.  Read only calls
+        skip the lock when the wrapped object supports concurrent reads."""
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        self.pending += 1
+        try:
+            if read_only and getattr(self.wrapped, "concurrent_reads", False):
+                return await loop.run_in_executor(
+                    self.executor, self._timed_call, name, submitted, func, args
+                )
+            async with self.lock:
+                return await loop.run_in_executor(
+                    self.executor, self._timed_call, name, submitted, func, args
+                )
+        finally:
+            self.pending -= 1
+            if self.closing and not self.pending:
+                self._close_wrapped()
+
+    def close(self):
+        """Releases what the wrapped object holds open (the connections of a
+        TourneyStore), once the calls in progress have finished."""
+        self.closing = True
+        if not self.pending:
+            self._close_wrapped()
+
+    def _close_wrapped(self):
+        """Closes the wrapped object, if it has anything to close."""
+        self.closing = False
+        close = getattr(self.wrapped, "close", None)
+        if close is not None:
+            close()
+
+    def _timed_call(self, name, submitted, func, args):
+        """Executed on a pool thread.  Wraps the call with the timing."""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            self.wait.setdefault(name, LatencyCounter()).record(started - submitted)
+            self.run.setdefault(name, LatencyCounter()).record(finished - started)
+
+    def report_latency(self):
+        """Returns a string containing the latency counters for every
+        operation called so far."""
+        lines = [f"File: {self.wrapped.filename}"]
+        for name in sorted(self.run):
+            lines.append(f"{name:22} wait {self.wait[name]}")
+            lines.append(f"{'':22} run  {self.run[name]}")
+        return "\n".join(lines)
+
+
+################################################################################
+class AsyncTourneyFile(AsyncFile):
+    """Asynchronous facade over bb_tournament.TourneyFile.  The method names
+    follow the wrapped class and must be awaited."""
+
+    async def read(self):
+        """Parses the tournament file."""
+        return await self.call("read", self.wrapped.read)
+
+    async def write(self, blob):
+        """Writes the tournament file."""
+        return await self.call("write", self.wrapped.write, blob)
+
+    async def add_team(self, team_str):
+        """Adds a team to the tournament."""
+        return await self.call("add_team", self.wrapped.add_team, team_str)
+
+    async def del_team(self, team_name):
+        """Removes a team from the tournament."""
+        return await self.call("del_team", self.wrapped.del_team, team_name)
+
+    async def add_week(self):
+        """Adds a blank week to the schedule."""
+        return await self.call("add_week", self.wrapped.add_week)
+
+    async def add_games(self, game_list):
+        """Adds games to the last week in the schedule."""
+        return await self.call("add_games", self.wrapped.add_games, game_list)
+
+    async def add_result(self, result_list):
+        """Records a game result in the current week."""
+        return await self.call("add_result", self.wrapped.add_result, result_list)
+
+    async def incr_week(self):
+        """Increments the current week."""
+        return await self.call("incr_week", self.wrapped.incr_week)
+
+    async def decr_week(self):
+        """Decrements the current week."""
+        return await self.call("decr_week", self.wrapped.decr_week)
+
+    async def report_teams_short(self):
+        """Renders the condensed team list."""
+        return await self.call(
+            "report_teams_short", self.wrapped.report_teams_short, read_only=True
+        )
+
+    async def report_full_schedule(self):
+        """Renders the full schedule."""
+        return await self.call(
+            "report_full_schedule", self.wrapped.report_full_schedule, read_only=True
+        )
+
+    async def report_current_week(self):
+        """Renders the current week of the schedule."""
+        return await self.call(
+            "report_current_week", self.wrapped.report_current_week, read_only=True
+        )
+
+    async def report_team(self, team):
+        """Renders the games of a single team."""
+        return await self.call(
+            "report_team", self.wrapped.report_team, team, read_only=True
+        )
+
+    async def report_standings(self):
+        """Renders the league standings."""
+        return await self.call(
+            "report_standings", self.wrapped.report_standings, read_only=True
+        )
+
+
+################################################################################
+class AsyncTriviaFile(AsyncFile):
+    """Asynchronous facade over bb_trivia.TriviaFile."""
+
+    async def read(self):
+        """Parses the trivia file."""
+        return await self.call("read", self.wrapped.read)
+
+    async def select(self):
+        """Returns a randomly selected bit of trivia, reading the file first
+        if that has not happened yet."""
+        return await self.call("select", lambda: self.wrapped.select)
+
+    async def select_for(self, channel, guild=None):
+        """Returns the next bit of trivia of a channel's shuffle bag, or a
+        weighted pick when the guild has weights."""
+        return await self.call("select_for", self.wrapped.select_for, channel, guild)
+
+    async def search(self, keywords):
+        """Returns a bit of trivia matching the keywords, or None."""
+        return await self.call("search", self.wrapped.search, keywords)
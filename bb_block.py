@@ -0,0 +1,170 @@
+#! python3
+"""This module implements a precomputed table of Blood Bowl block dice odds.
+For 1-3 dice, attacker or defender choosing the die, and any combination of
+the skills that change how a block die is resolved, the table holds the exact
+chance of every outcome of the block so that a question is answered with a
+single dictionary lookup."""
+import argparse
+import itertools
+from fractions import Fraction
+
+# Block die faces
+SKULL = "attacker down"
+BOTH = "both down"
+PUSH = "push"
+STUMBLE = "defender stumbles"
+POW = "defender down"
+FACES = (SKULL, BOTH, PUSH, PUSH, STUMBLE, POW)
+
+# Outcomes, from the best to the worst for the attacker.  'No effect' is a
+# both down when both players have Block.  A Wrestle counts as both down.
+OUTCOMES = ("knockdown", "push", "no effect", "both down", "attacker down")
+RANK = {outcome: idx for idx, outcome in enumerate(OUTCOMES)}
+
+CHOOSERS = ("attacker", "defender")
+# Juggernaut only works on a Blitz, having it here means the attacker blitzes.
+ATTACKER_SKILLS = ("block", "tackle", "wrestle", "juggernaut")
+DEFENDER_SKILLS = ("block", "dodge", "wrestle")
+
+
+################################################################################
+def resolve_face(face, attacker, defender):
+    """Returns the outcome of a single block die face given the skill sets of
+    both players.  Optional skills are used by their owner when they improve
+    the outcome for them."""
+    if face == SKULL:
+        return "attacker down"
+    if face == PUSH:
+        return "push"
+    if face == POW:
+        return "knockdown"
+    if face == STUMBLE:
+        if "dodge" in defender and "tackle" not in attacker:
+            return "push"
+        return "knockdown"
+    # Both down
+    if "block" in attacker and "block" in defender:
+        outcome = "no effect"
+    elif "block" in attacker:
+        outcome = "knockdown"
+    elif "block" in defender:
+        outcome = "attacker down"
+    else:
+        outcome = "both down"
+    # Wrestle places both players prone instead of only its owner, and
+    # Juggernaut cancels the defender's Wrestle.
+    if outcome == "knockdown" and "wrestle" in defender and "juggernaut" not in attacker:
+        outcome = "both down"
+    if outcome == "attacker down" and "wrestle" in attacker:
+        outcome = "both down"
+    # Juggernaut lets the attacker treat the result as a push.
+    if "juggernaut" in attacker and RANK["push"] < RANK[outcome]:
+        outcome = "push"
+    return outcome
+
+
+def _skill_sets(skills):
+    """Returns every subset of the skill list as frozensets."""
+    for size in range(len(skills) + 1):
+        for combo in itertools.combinations(skills, size):
+            yield frozenset(combo)
+
+
+################################################################################
+class BlockTable(dict):
+    """A dictionary built once holding the odds of every block.  Keys are
+    (number of dice, chooser, attacker skills, defender skills) with the skills
+    as frozensets, values are dictionaries of outcome to exact probability."""
+
+    def __init__(self):
+        super().__init__()
+        for attacker in _skill_sets(ATTACKER_SKILLS):
+            for defender in _skill_sets(DEFENDER_SKILLS):
+                outcomes = [resolve_face(face, attacker, defender) for face in FACES]
+                for num_dice in range(1, 4):
+                    for chooser in CHOOSERS:
+                        pick = min if chooser == "attacker" else max
+                        counts = dict.fromkeys(OUTCOMES, 0)
+                        for roll in itertools.product(outcomes, repeat=num_dice):
+                            counts[pick(roll, key=RANK.get)] += 1
+                        total = len(FACES) ** num_dice
+                        self[(num_dice, chooser, attacker, defender)] = {
+                            outcome: Fraction(count, total)
+                            for outcome, count in counts.items()
+                        }
+
+    def odds(self, num_dice, chooser="attacker", attacker=(), defender=()):
+        """Looks up the odds of a block.  Raises ValueError for combinations
+        outside of the table."""
+        key = (num_dice, chooser, frozenset(attacker), frozenset(defender))
+        if key not in self:
+            raise ValueError(
+                f"No odds for {num_dice} dice, {chooser} choosing, attacker skills "
+                f"{sorted(attacker)}, defender skills {sorted(defender)}"
+            )
+        return self[key]
+
+    def report(self, num_dice, chooser="attacker", attacker=(), defender=()):
+        """Returns a string listing the odds of every outcome of a block."""
+        odds = self.odds(num_dice, chooser, attacker, defender)
+        attacker_str = ", ".join(sorted(attacker)) or "none"
+        defender_str = ", ".join(sorted(defender)) or "none"
+        lines = [
+            f"{num_dice} dice, {chooser} chooses",
+            f"Attacker skills: {attacker_str} | Defender skills: {defender_str}",
+        ]
+        for outcome in OUTCOMES:
+            lines.append(f"{outcome.capitalize():15} {float(odds[outcome]) * 100:6.2f}%")
+        return "\n".join(lines)
+
+
+def parse_block(words):
+    """Parses a block description such as '2 attacker block vs dodge' (the
+    chooser defaults to the attacker) and returns the arguments of
+    BlockTable.odds.  Raises ValueError on invalid input."""
+    words = [word.lower() for word in words]
+    if not words or not words[0].isdigit():
+        raise ValueError("The number of dice must come first.")
+    num_dice = int(words[0])
+    if not 0 < num_dice <= 3:
+        raise ValueError("Block odds are only available for 1-3 dice.")
+    words = words[1:]
+    chooser = "attacker"
+    if words and words[0] in CHOOSERS:
+        chooser = words.pop(0)
+    if "vs" in words:
+        split = words.index("vs")
+        attacker, defender = words[:split], words[split + 1 :]
+    else:
+        attacker, defender = words, []
+    for skill in attacker:
+        if skill not in ATTACKER_SKILLS:
+            raise ValueError(f"Attacker skill {skill} not supported.")
+    for skill in defender:
+        if skill not in DEFENDER_SKILLS:
+            raise ValueError(f"Defender skill {skill} not supported.")
+    return num_dice, chooser, frozenset(attacker), frozenset(defender)
+
+
+################################################################################
+def main():
+    """Main command line entry point"""
+    parser = argparse.ArgumentParser(
+        prog="bb_block", description="Prints the odds of a Blood Bowl block."
+    )
+    parser.add_argument(
+        "block",
+        nargs="+",
+        help="""Number of dice, optionally who chooses (attacker or defender),
+        then the attacker skills, 'vs' and the defender skills.  Example:
+        2 attacker block vs dodge""",
+    )
+    args = parser.parse_args()
+
+    table = BlockTable()
+    print(table.report(*parse_block(args.block)))
+
+
+################################################################################
+if __name__ == "__main__":
+    main()
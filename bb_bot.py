@@ -2,29 +2,48 @@
 # See https://realpython.com/how-to-make-a-discord-bot-python/
 import os
 import argparse
+import asyncio
 import itertools
+import logging
 import random
 import xdice
+import bb_async
+import bb_block
+import bb_logging
+import bb_metrics
+import bb_registry
 import bb_trivia
-import bb_tournament
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
 
 
 ################################################################################
-# Test method for getting used to Discord API
+# Debug record of the message behind a command
 ################################################################################
+log = logging.getLogger("bb.bot")
+
+
 def dump_context(ctx):
-    print("Message Parameters Dump")
-    print("=======================")
-    print(f"Message Author Name: {ctx.author.name}")
-    print(f"Message Author Discrminator: {ctx.author.discriminator}")
-    print(f"Message Author is a Bot: {ctx.author.bot}")
-    print(f"Message Content: {ctx.message.content}")
-    print(f"Message was in Guild: {ctx.guild}")
-    print(f"Message was in channel: {ctx.channel}")
-    print(f"Message printed at: {ctx.message.created_at}")
+    """Logs the message parameters as a debug record of the command logger,
+    only built when debug is enabled for that command."""
+    logger = bb_logging.command_logger(ctx.command.qualified_name)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(
+        "message context",
+        extra={
+            "fields": {
+                "author": ctx.author.name,
+                "discriminator": ctx.author.discriminator,
+                "author_is_bot": ctx.author.bot,
+                "content": ctx.message.content,
+                "guild": str(ctx.guild),
+                "channel": str(ctx.channel),
+                "created_at": str(ctx.message.created_at),
+            }
+        },
+    )
 
 
 ################################################################################
@@ -34,28 +53,170 @@ parser = argparse.ArgumentParser(
     prog="bb_bot", description="Discord Bot handling casual Blood Bowl stuff."
 )
 parser.add_argument("--trivia_file", help="The trivia data file (YAML format).")
+parser.add_argument(
+    "--trivia_weights",
+    help="""YAML file of per guild trivia weights by tag or topic, see
+    bb_trivia.  Guilds with weights get weighted picks instead of the
+    shuffle bag.""",
+)
 parser.add_argument("--tourney_file", help="The tournament data file (YAML format).")
+parser.add_argument(
+    "--io_threads",
+    type=int,
+    default=4,
+    help="Number of threads used for reading and writing the data files.",
+)
+parser.add_argument(
+    "--tourney_backend",
+    choices=["yaml", "sqlite"],
+    default="yaml",
+    help="Storage of the tournament data.  With sqlite, --tourney_file is the database.",
+)
+parser.add_argument(
+    "--tourney_name",
+    default="default",
+    help="Name of the tournament in the database (sqlite backend only).",
+)
+parser.add_argument(
+    "--journal",
+    action="store_true",
+    help="Records tournament changes in a journal instead of rewriting the file.",
+)
+parser.add_argument(
+    "--tourney_map",
+    help="""YAML file mapping guild ids (or 'guild id/channel id') to
+    tournaments, see bb_registry.  --tourney_file serves everything else.""",
+)
+parser.add_argument(
+    "--tourney_cache",
+    type=int,
+    default=16,
+    help="Maximum number of tournaments kept parsed in memory.",
+)
+parser.add_argument(
+    "--tourney_idle",
+    type=int,
+    default=3600,
+    help="Seconds after which an unused tournament is dropped from memory.",
+)
+parser.add_argument(
+    "--metrics_port",
+    type=int,
+    help="""Local port serving the command metrics in the Prometheus text
+    format.  Not served if not given, !stats works either way.""",
+)
+parser.add_argument(
+    "--lag_interval",
+    type=float,
+    default=1.0,
+    help="Seconds between two samples of the event loop lag.",
+)
+parser.add_argument(
+    "--log_level",
+    default="INFO",
+    type=str.upper,
+    choices=bb_logging.LEVELS,
+    help="Level of the bot log records.",
+)
+parser.add_argument(
+    "--log_commands",
+    help="""Per command log levels, for example 'trivia=DEBUG,roll=WARNING'.
+    At DEBUG a command logs the context of every message.""",
+)
+parser.add_argument(
+    "--log_sample",
+    type=int,
+    default=1,
+    help="Keeps only one in this many debug records of every logger.",
+)
+parser.add_argument(
+    "--log_json",
+    action="store_true",
+    help="Writes the log records as JSON lines.",
+)
 args = parser.parse_args()
-trivia_file = bb_trivia.TriviaFile(args.trivia_file)
-tourney_file = bb_tournament.TourneyFile(args.tourney_file)
+try:
+    command_levels = bb_logging.parse_levels(args.log_commands)
+except ValueError as e:
+    parser.error(str(e))
+# Logging goes through a queue, the writing happens on a separate thread.
+bb_logging.setup(
+    args.log_level,
+    command_levels,
+    args.log_sample,
+    args.log_json,
+)
+# File parsing and writing is blocking, so the bot only ever talks to the
+# data files through the asynchronous facades.
+io_pool = bb_async.create_executor(args.io_threads)
+trivia_file = bb_async.AsyncTriviaFile(
+    bb_trivia.TriviaFile(args.trivia_file, weights_file=args.trivia_weights), io_pool
+)
+# Tournaments are looked up per guild and channel, and only loaded when used.
+default_tourney = None
+if args.tourney_file:
+    default_tourney = {
+        "file": args.tourney_file,
+        "backend": args.tourney_backend,
+        "name": args.tourney_name,
+    }
+tourneys = bb_registry.TourneyRegistry(
+    args.tourney_map,
+    default_tourney,
+    io_pool,
+    capacity=args.tourney_cache,
+    idle_seconds=args.tourney_idle,
+    journal=args.journal,
+)
+idle_sweeper = None
+metrics = bb_metrics.Metrics(args.lag_interval)
+block_table = bb_block.BlockTable()
 
 
 ################################################################################
 # Discord Bot Commands
 ################################################################################
 bot = commands.Bot(command_prefix="!")
+metrics.install(bot)
 
 
 @bot.event
 async def on_ready():
-    print(f"{bot.user.name} has connected to Discord.")
+    global idle_sweeper
+    log.info("%s has connected to Discord.", bot.user.name)
+    # on_ready fires again after reconnecting, only start the tasks once.
+    if idle_sweeper is None:
+        idle_sweeper = bot.loop.create_task(sweep_idle_tourneys())
+        bot.loop.create_task(metrics.sample_loop_lag())
+        if args.metrics_port:
+            await metrics.serve(args.metrics_port)
+
+
+async def sweep_idle_tourneys():
+    """Drops idle tournaments even when no command comes in."""
+    while True:
+        await asyncio.sleep(60)
+        tourneys.evict_idle()
 
 
-@bot.command(name="trivia", help="Responds with a randomly selected bit of trivia.")
-async def trivia(ctx):
+@bot.command(
+    name="trivia",
+    help="""Responds with a bit of trivia.  A channel sees every bit of trivia
+    once before any is repeated.  With keywords, responds with trivia about
+    them instead.  Example: !trivia halfling""",
+)
+async def trivia(ctx, *, keywords=None):
     dump_context(ctx)
-    tidbit = trivia_file.select
-    print(tidbit)
+    if keywords:
+        tidbit = await trivia_file.search(keywords)
+        if tidbit is None:
+            tidbit = f"No trivia found about {keywords}."
+    else:
+        guild_id = ctx.guild.id if ctx.guild else None
+        tidbit = await trivia_file.select_for(ctx.channel.id, guild_id)
+    bb_logging.command_logger("trivia").debug(
+        "trivia sent", extra={"fields": {"keywords": keywords, "tidbit": tidbit}}
+    )
     await ctx.send(tidbit)
 
 
@@ -82,17 +243,51 @@ async def block_error(ctx, error):
         await ctx.send("ERROR: Missing Required Argument")
 
 
+@bot.command(
+    name="blockodds",
+    help="""Responds with the odds of a block.  Takes the number of dice (1-3),
+    optionally who chooses (attacker or defender), the attacker skills, 'vs' and
+    the defender skills.  Example: 2 attacker block vs dodge""",
+)
+async def blockodds(ctx, *words):
+    try:
+        strblock = block_table.report(*bb_block.parse_block(words))
+    except ValueError as e:
+        await ctx.send(f"ERROR: {e}")
+        return
+    await ctx.send("```" + strblock + "```")
+
+
 @bot.command(
     name="report",
-    help="Prints a report on the current tournament.  Valid options: 'team_summary' and 'current_week'",
+    help="Prints a report on the current tournament.  Valid options: 'team_summary', 'current_week', 'standings' and 'team <name|index>'",
 )
-async def report(ctx, option):
+async def report(ctx, option, *, team=None):
+    tourney_file = tourneys.get(ctx.guild.id if ctx.guild else None, ctx.channel.id)
+    if tourney_file is None:
+        await ctx.send("ERROR: No tournament is set up for this channel.")
+        return
     if option == "team_summary":
-        strblock = tourney_file.report_teams_short()
+        strblock = await tourney_file.report_teams_short()
         strblock = "```" + strblock + "```"
         await ctx.send(strblock)
     elif option == "current_week":
-        strblock = tourney_file.report_current_week()
+        strblock = await tourney_file.report_current_week()
+        strblock = "```" + strblock + "```"
+        await ctx.send(strblock)
+    elif option == "team":
+        if team is None:
+            await ctx.send("ERROR: Missing team name or index")
+            return
+        try:
+            strblock = await tourney_file.report_team(team)
+        except ValueError as e:
+            await ctx.send(f"ERROR: {e}")
+            return
+        strblock = "```" + strblock + "```"
+        await ctx.send(strblock)
+    elif option == "standings":
+        strblock = await tourney_file.report_standings()
         strblock = "```" + strblock + "```"
         await ctx.send(strblock)
     else:
@@ -103,6 +298,31 @@ async def report_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("ERROR: Missing Required Argument")
 
+@bot.command(
+    name="stats",
+    help="""Prints the command metrics (administrators only).  With 'io',
+    prints the time file operations spent queued and running instead.""",
+)
+@commands.has_permissions(administrator=True)
+async def stats(ctx, section=None):
+    if section == "io":
+        reports = [tourneys.report(), trivia_file.report_latency()]
+        reports += [tourney.report_latency() for tourney in tourneys.facades()]
+        text = "\n\n".join(reports)
+        # Discord refuses messages over 2000 characters.
+        if len(text) > 1900:
+            text = text[:1900] + "\n..."
+    else:
+        text = metrics.report()
+    await ctx.send("```" + text + "```")
+
+
+@stats.error
+async def stats_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("ERROR: Only administrators may see the metrics.")
+
+
 @bot.command(
     name="roll",
     help="""Takes a dice expression as an argument (may contain simple math
@@ -111,7 +331,9 @@ async def report_error(ctx, error):
 async def roll(ctx, *, arg):
     ps = xdice.roll(arg)
     line = f"```Roll Result: {ps} ---- Roll Internals: {ps.format()}```"
-    print(line)
+    bb_logging.command_logger("roll").debug(
+        "roll", extra={"fields": {"expression": arg, "result": str(ps)}}
+    )
     await ctx.send(line)
 
 @roll.error
@@ -119,6 +341,28 @@ async def roll_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("ERROR: Missing Required Argument")
 
+@bot.command(
+    name="odds",
+    help="""Takes a dice expression as an argument and responds with the exact
+    odds of every result.  Example: 10d6l2 + 3"""
+)
+async def odds(ctx, *, arg):
+    # Computing the distribution is CPU work, keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    try:
+        dist = await loop.run_in_executor(
+            io_pool, lambda: xdice.cached_compile(arg).distribution()
+        )
+    except (ValueError, ZeroDivisionError) as e:
+        await ctx.send(f"ERROR: {e}")
+        return
+    await ctx.send(f"```Odds for {arg}\n{dist.format(limit=40)}```")
+
+@odds.error
+async def odds_error(ctx, error):
+    if isinstance(error, commands.MissingRequiredArgument):
+        await ctx.send("ERROR: Missing Required Argument")
+
 
 ################################################################################
 # Initialize and launch the bot
@@ -126,5 +370,5 @@ async def roll_error(ctx, error):
 ################################################################################
 load_dotenv()
 token = os.getenv("BBB_DISCORD_TOKEN")
-print(f"Proceeding with BloodBowlBot Token: {token}")
+log.info("Proceeding with the BloodBowlBot token from BBB_DISCORD_TOKEN.")
 bot.run(token)
@@ -6,6 +6,8 @@
 ################################################################################
 import os
 import argparse
+import contextlib
+import threading
 
 import sqlite3
 from sqlite3 import Error
@@ -14,16 +16,113 @@ import sql_strings as sqlstr
 
 
 ################################################################################
-def create_connection(db_file):
+def create_connection(db_file, check_same_thread=True):
     db_conn = None
     try:
-        db_conn = sqlite3.connect(db_file)
+        db_conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
     except Error as e:
         print(e)
 
     return db_conn
 
 
+################################################################################
+class ConnectionManager:
+    """Long lived, tuned connections to one database: a single writer
+    connection and read-only connections, one per reader thread.  Every
+    connection has foreign keys on, synchronous=NORMAL, a sized page cache and
+    a prepared statement cache, and the database is switched to WAL so that
+    readers are never blocked behind the writer.
+
+    reading() and writing() can be used from any thread, the bot calls them
+    from the bb_async thread pool.  After close() the connections are opened
+    again on next use."""
+
+    def __init__(self, db_file, cache_kib=16384, statements=256):
+        self.db_file = db_file
+        self.cache_kib = cache_kib
+        self.statements = statements
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._readers = []
+
+    def _connect(self, read_only):
+        """Opens and tunes a connection."""
+        if read_only:
+            uri = f"file:{os.path.abspath(self.db_file)}?mode=ro"
+        else:
+            uri = f"file:{os.path.abspath(self.db_file)}"
+        db_conn = sqlite3.connect(
+            uri,
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statements,
+        )
+        if not read_only:
+            db_conn.execute(sqlstr.wal_pragma)
+        for pragma in sqlstr.connection_pragmas:
+            db_conn.execute(pragma.format(cache_kib=self.cache_kib))
+        return db_conn
+
+    @property
+    def writer(self):
+        """The writer connection.  Use writing() rather than this directly."""
+        if self._writer is None:
+            self._writer = self._connect(read_only=False)
+        return self._writer
+
+    def reader(self):
+        """Returns the read-only connection of the calling thread."""
+        db_conn = getattr(self._local, "reader", None)
+        if db_conn is None:
+            db_conn = self._local.reader = self._connect(read_only=True)
+            self._readers.append(db_conn)
+        return db_conn
+
+    @contextlib.contextmanager
+    def reading(self):
+        """Context manager yielding the thread's read-only connection inside
+        a read transaction, so that several queries see the same snapshot."""
+        db_conn = self.reader()
+        db_conn.execute("BEGIN")
+        try:
+            yield db_conn
+        finally:
+            if db_conn.in_transaction:
+                db_conn.execute("ROLLBACK")
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Context manager yielding the writer connection inside a
+        transaction, committed on success and rolled back on error.  Writers
+        from different threads are serialized."""
+        with self._write_lock:
+            db_conn = self.writer
+            db_conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield db_conn
+            except BaseException:
+                if db_conn.in_transaction:
+                    db_conn.execute("ROLLBACK")
+                raise
+            # Helpers such as init_enum_tables may have committed already.
+            if db_conn.in_transaction:
+                db_conn.execute("COMMIT")
+
+    def close(self):
+        """Closes every connection."""
+        for db_conn in self._readers:
+            db_conn.close()
+        self._readers = []
+        # Threads still holding a closed reader get a new one on next use.
+        self._local = threading.local()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
 ################################################################################
 def create_table(db_conn, sql_cmd):
     try:
@@ -45,32 +144,60 @@ def init_tables(db_conn):
     create_table(db_conn, sqlstr.create_tournaments_table)
     create_table(db_conn, sqlstr.create_tournament_teams_table)
     create_table(db_conn, sqlstr.create_games_table)
+    # Indexes
+    for sql_cmd in sqlstr.create_indexes:
+        create_table(db_conn, sql_cmd)
 
 
 ################################################################################
 def init_enum_tables(db_conn):
-    sqlcmd = sqlstr.insert_gamestate_cmd
     c = db_conn.cursor()
-    for item in sqlstr.initial_gamestate_table:
-        c.execute(sqlcmd, item)
-    sqlcmd = sqlstr.insert_race_cmd
-    for item in sqlstr.initial_race_table:
-        c.execute(sqlcmd, item)
-    sqlcmd = sqlstr.insert_tourneystate_cmd
-    for item in sqlstr.initial_tourneystate_table:
-        c.execute(sqlcmd, item)
+    c.executemany(sqlstr.insert_gamestate_cmd, sqlstr.initial_gamestate_table)
+    c.executemany(sqlstr.insert_race_cmd, sqlstr.initial_race_table)
+    c.executemany(sqlstr.insert_tourneystate_cmd, sqlstr.initial_tourneystate_table)
     db_conn.commit()
 
 
 ################################################################################
-def add_coach(db_conn, coach):
+def add_coach(db_conn, coach, commit=True):
     sqlcmd = sqlstr.insert_coach_cmd
     c = db_conn.cursor()
     c.execute(sqlcmd, coach)
-    db_conn.commit()
+    if commit:
+        db_conn.commit()
     return c.lastrowid
 
 
+################################################################################
+def migrate(db_conn, yaml_files, name=None, fast=False):
+    # Imported here since bb_store builds on this module.
+    import bb_store
+
+    if name is not None and len(yaml_files) > 1:
+        raise ValueError("A tournament name can only be given for a single file.")
+    init_tables(db_conn)
+    c = db_conn.cursor()
+    c.execute(sqlstr.count_gamestates_cmd)
+    if c.fetchone()[0] == 0:
+        init_enum_tables(db_conn)
+    if fast:
+        for pragma in sqlstr.bulk_load_pragmas:
+            c.execute(pragma)
+    try:
+        # A single transaction for every file: all of them or nothing.
+        with db_conn:
+            for yaml_file in yaml_files:
+                tourney_name = name or os.path.splitext(os.path.basename(yaml_file))[0]
+                num_teams, num_games = bb_store.migrate_yaml(
+                    db_conn, yaml_file, tourney_name
+                )
+                print(f"{yaml_file}: tournament {tourney_name}, {num_teams} teams, {num_games} games.")
+    finally:
+        if fast:
+            for pragma in sqlstr.restore_pragmas:
+                c.execute(pragma)
+
+
 ################################################################################
 def get_all_coaches(db_conn):
     c = db_conn.cursor()
@@ -93,8 +220,32 @@ def main():
         help="""Deletes the specified database and recreates database initial state
         including enumerated state tables.""",
     )
+    parser.add_argument(
+        "--migrate",
+        nargs="+",
+        metavar="YAML",
+        help="""Loads tournament files (YAML format) into the database, creating
+        the tables if needed.  Each file becomes a tournament named after the
+        file unless --name is given.  Everything is loaded in one transaction.""",
+    )
+    parser.add_argument(
+        "--name", help="Tournament name for --migrate (single file only)."
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="""Relaxes the database durability settings while migrating.  Only
+        use on a database which can be recreated if the load is interrupted.""",
+    )
     args = parser.parse_args()
 
+    if args.migrate:
+        db_conn = create_connection(args.filename)
+        if db_conn is not None:
+            migrate(db_conn, args.migrate, args.name, args.fast)
+        else:
+            print("Error: DB connection handle invalid.")
+
     if args.initialize:
         answer = input(
             f"Are you VERY sure you wish to delete {args.filename} and recreate?  Type YES to continue, any other input to exit: "
@@ -0,0 +1,116 @@
+#! python3
+"""This module implements the logging setup of the Discord Bot.  Records are
+put on a queue by a QueueHandler and written out by a QueueListener thread,
+so a slow terminal or journal never blocks the event loop.  Every command
+logs to its own logger (bb.command.<name>) whose level can be set on its
+own, and high volume debug records can be sampled.  Records carry
+structured fields which are written as key=value pairs or as JSON lines."""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+ROOT = "bb"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+# Listeners started by setup(), stopped by shutdown().
+_listeners = []
+
+
+################################################################################
+class StructuredFormatter(logging.Formatter):
+    """Formats a record with the fields passed in extra={"fields": {...}}
+    appended as key=value pairs, or the whole record as a JSON object."""
+
+    def __init__(self, json_lines=False):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.json_lines:
+            entry = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through one in every `rate` records at DEBUG level or below,
+    counting per logger.  Other levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(1, rate)
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        count = self.seen.get(record.name, 0)
+        self.seen[record.name] = count + 1
+        return count % self.rate == 0
+
+
+################################################################################
+def command_logger(name):
+    """Returns the logger of a bot command."""
+    return logging.getLogger(f"{ROOT}.command.{name}")
+
+
+def parse_levels(spec):
+    """Parses 'trivia=DEBUG,roll=WARNING' into {'trivia': 'DEBUG', ...}.
+    Raises ValueError on an unknown level."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, level = item.partition("=")
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level} for {name}")
+        levels[name.strip()] = level
+    return levels
+
+
+def setup(level="INFO", command_levels=None, sample=1, json_lines=False, stream=None):
+    """Routes the records of the bb loggers through a queue to a listener
+    thread writing them to stream (stderr by default).  command_levels maps
+    command names to their own levels, and sample keeps one in that many
+    debug records.  Returns the started listener, see shutdown()."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(json_lines))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, handler, respect_handler_level=True
+    )
+    queue_handler = logging.handlers.QueueHandler(records)
+    if sample > 1:
+        queue_handler.addFilter(SamplingFilter(sample))
+    root = logging.getLogger(ROOT)
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level.upper())
+    root.propagate = False
+    for name, command_level in (command_levels or {}).items():
+        command_logger(name).setLevel(command_level)
+    listener.start()
+    if not _listeners:
+        atexit.register(shutdown)
+    _listeners.append(listener)
+    return listener
+
+
+def shutdown():
+    """Stops the listeners, writing out the records still queued.  Called
+    at exit."""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,242 @@
+#! python3
+"""This module implements the metrics of the Discord Bot: call and error
+counts and latency histograms for every command, and a histogram of the lag
+of the event loop sampled on a timer.  They are published in the Prometheus
+text format on a local HTTP port, and summarized by the !stats command.
+
+Recording a command costs a clock read in the before hook, and a clock read,
+a bisection in the bucket bounds and a few additions in the after hook."""
+import asyncio
+import bisect
+import time
+import bb_logging
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+################################################################################
+class Histogram:
+    """Class counts observations in fixed buckets, keeping the total too.
+    Counts are per bucket, they are made cumulative when exported."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # The last bucket holds everything above the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Records one observation."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self):
+        """Average of the observations."""
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.count
+
+    def quantile(self, fraction):
+        """Estimates a quantile by interpolating inside its bucket.  Values
+        in the last bucket are reported as the last bound."""
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if idx == len(self.bounds):
+                    return self.bounds[-1]
+                low = self.bounds[idx - 1] if idx else 0.0
+                return low + (self.bounds[idx] - low) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def exposition(self, name, labels=""):
+        """Returns the Prometheus text lines of the histogram."""
+        lines = []
+        cumulative = 0
+        sep = "," if labels else ""
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class CommandStats:
+    """Class holds the metrics of a single bot command."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+################################################################################
+class Metrics:
+    """Class collects the metrics of the bot.  install() hooks it into a
+    discord.ext.commands.Bot."""
+
+    def __init__(self, lag_interval=1.0):
+        self.commands = {}
+        self.lag_interval = lag_interval
+        self.loop_lag = Histogram()
+        self.started = time.time()
+
+    def install(self, bot):
+        """Registers the hooks timing every command of the bot."""
+        bot.before_invoke(self.before_invoke)
+        bot.after_invoke(self.after_invoke)
+        bot.add_listener(self.on_command_error, "on_command_error")
+
+    def _stats(self, name):
+        """Returns the metrics of a command, creating them on first use."""
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        return stats
+
+    async def before_invoke(self, ctx):
+        """Stamps the context with the start of the command."""
+        ctx.metrics_started = time.perf_counter()
+
+    async def after_invoke(self, ctx):
+        """Records the command, also called when the command failed."""
+        elapsed = time.perf_counter() - ctx.metrics_started
+        stats = self._stats(ctx.command.qualified_name)
+        stats.calls += 1
+        if ctx.command_failed:
+            stats.errors += 1
+        stats.latency.observe(elapsed)
+
+    async def on_command_error(self, ctx, error):
+        """Counts the commands which failed before the hooks ran (a failed
+        check or a bad argument), the others are counted by after_invoke.
+
+        Having this listener stops discord.py from printing the errors, so
+        they are logged here instead: an exception raised by the command
+        always (the error handlers of the commands only deal with bad input),
+        other errors when the command has no error handler."""
+        if ctx.command is not None and not hasattr(ctx, "metrics_started"):
+            stats = self._stats(ctx.command.qualified_name)
+            stats.calls += 1
+            stats.errors += 1
+        original = getattr(error, "original", None)
+        if original is None and hasattr(ctx.command, "on_error"):
+            return
+        name = ctx.command.qualified_name if ctx.command is not None else "unknown"
+        bb_logging.command_logger(name).error(
+            "command failed",
+            exc_info=original or error,
+            extra={"fields": {"message": getattr(ctx.message, "content", None)}},
+        )
+
+    async def sample_loop_lag(self):
+        """Runs forever, measuring how late the event loop wakes up from a
+        sleep.  Lag shows blocking work done on the loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, loop.time() - before - self.lag_interval))
+
+    def exposition(self):
+        """Returns every metric in the Prometheus text format."""
+        lines = [
+            "# HELP bb_command_calls_total Bot commands invoked.",
+            "# TYPE bb_command_calls_total counter",
+        ]
+        names = sorted(self.commands)
+        for name in names:
+            lines.append(
+                f'bb_command_calls_total{{command="{name}"}} {self.commands[name].calls}'
+            )
+        lines.append("# HELP bb_command_errors_total Bot commands which failed.")
+        lines.append("# TYPE bb_command_errors_total counter")
+        for name in names:
+            lines.append(
+                f'bb_command_errors_total{{command="{name}"}} {self.commands[name].errors}'
+            )
+        lines.append("# HELP bb_command_latency_seconds Bot command latency.")
+        lines.append("# TYPE bb_command_latency_seconds histogram")
+        for name in names:
+            lines.extend(
+                self.commands[name].latency.exposition(
+                    "bb_command_latency_seconds", f'command="{name}"'
+                )
+            )
+        lines.append("# HELP bb_event_loop_lag_seconds Lateness of the event loop.")
+        lines.append("# TYPE bb_event_loop_lag_seconds histogram")
+        lines.extend(self.loop_lag.exposition("bb_event_loop_lag_seconds"))
+        lines.append("# HELP bb_start_time_seconds Start time of the bot.")
+        lines.append("# TYPE bb_start_time_seconds gauge")
+        lines.append(f"bb_start_time_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Returns a human readable summary of the metrics."""
+        lines = [
+            f"{'Command':12} {'Calls':>7} {'Errors':>6} {'Mean ms':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8}"
+        ]
+        for name in sorted(self.commands):
+            stats = self.commands[name]
+            latency = stats.latency
+            lines.append(
+                f"{name:12} {stats.calls:7} {stats.errors:6} "
+                f"{latency.mean * 1000:8.2f} {latency.quantile(0.5) * 1000:8.2f} "
+                f"{latency.quantile(0.95) * 1000:8.2f}"
+            )
+        lag = self.loop_lag
+        lines.append(
+            f"Event loop lag: mean {lag.mean * 1000:.2f} ms "
+            f"p95 {lag.quantile(0.95) * 1000:.2f} ms ({lag.count} samples)"
+        )
+        uptime = time.time() - self.started
+        lines.append(f"Uptime: {uptime / 3600:.1f} h")
+        return "\n".join(lines)
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Starts the HTTP server answering every request with the metrics
+        (so Prometheus can scrape any path, /metrics included)."""
+
+        async def handle(reader, writer):
+            try:
+                # The request itself does not matter, read up to the headers end.
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.exposition().encode("utf-8")
+                writer.write(
+                    b"HTTP/1.0 200 OK\r\n"
+                    b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+                    + body
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,234 @@
+#! python3
+"""This module implements schedule generation for Blood Bowl leagues.  The
+functions only deal with team indexes and return rounds of (home, away)
+pairs, leaving the tournament file classes to store the games.  A bye is
+represented the same way as in the tournament file, with the team at home
+and 9999 as the away index."""
+
+BYE = 9999
+
+
+################################################################################
+def round_robin(num_teams, double=False):
+    """Returns the rounds of a round robin between num_teams teams using the
+    circle method: one position is fixed and the others rotate by one place
+    every round, so every team meets every other team exactly once.  With an
+    odd number of teams the fixed position is the bye.
+
+    Home and away alternate for the fixed position from round to round and
+    by board for the others, which keeps every team within one game of an
+    even home/away split and gives the fewest possible back to back home
+    (or away) games.  With double set a second round robin follows with
+    home and away swapped."""
+    if num_teams < 2:
+        raise ValueError("A round robin needs at least two teams.")
+    circle = list(range(num_teams))
+    if num_teams % 2:
+        circle.insert(0, BYE)
+    size = len(circle)
+    rounds = []
+    for round_idx in range(size - 1):
+        pairs = []
+        for board in range(size // 2):
+            home, away = circle[board], circle[size - 1 - board]
+            if (board == 0 and round_idx % 2) or (board > 0 and board % 2):
+                home, away = away, home
+            if home == BYE:
+                home, away = away, home
+            pairs.append((home, away))
+        # Byes go last, as with --add_games.
+        pairs.sort(key=lambda pair: pair[1] == BYE)
+        rounds.append(pairs)
+        # Keep the first position and rotate the rest.
+        circle = [circle[0], circle[-1]] + circle[1:-1]
+    if double:
+        rounds += [
+            [(away, home) if away != BYE else (home, away) for home, away in pairs]
+            for pairs in rounds
+        ]
+    return rounds
+
+
+################################################################################
+def history(num_teams, games):
+    """Returns what the Swiss pairing needs to know about the games so far,
+    given as (home, away) pairs: for every team a bitset of the teams it has
+    played (bit j set for team j), its number of byes and its number of home
+    games."""
+    played = [0] * num_teams
+    byes = [0] * num_teams
+    homes = [0] * num_teams
+    for home, away in games:
+        if home >= num_teams:
+            continue
+        if away == BYE:
+            byes[home] += 1
+        elif away < num_teams:
+            played[home] |= 1 << away
+            played[away] |= 1 << home
+            homes[home] += 1
+    return played, byes, homes
+
+
+def _greedy(order, played):
+    """Pairs the teams top down, each with the best placed team after it
+    that it has not played yet.  Since the order is the ranking this keeps
+    pairings inside score groups, with the odd team out floating down to the
+    next group.  Returns None when some team is left without an opponent."""
+    unpaired = list(order)
+    pairs = []
+    while unpaired:
+        team = unpaired.pop(0)
+        for idx, other in enumerate(unpaired):
+            if not played[team] >> other & 1:
+                pairs.append((team, unpaired.pop(idx)))
+                break
+        else:
+            return None
+    return pairs
+
+
+def _perfect_matching(num, neighbors):
+    """Edmonds' blossom algorithm on vertices 0 to num-1 and adjacency lists
+    neighbors.  Returns the mate of every vertex, or None if the graph has no
+    perfect matching."""
+    match = [-1] * num
+    # A greedy start leaves only a few vertices to augment.
+    for v in range(num):
+        if match[v] == -1:
+            for w in neighbors[v]:
+                if match[w] == -1:
+                    match[v], match[w] = w, v
+                    break
+
+    def find_path(root):
+        parent = [-1] * num
+        base = list(range(num))
+        used = [False] * num
+        used[root] = True
+        queue = [root]
+
+        def lca(a, b):
+            seen = [False] * num
+            while True:
+                a = base[a]
+                seen[a] = True
+                if match[a] == -1:
+                    break
+                a = parent[match[a]]
+            while True:
+                b = base[b]
+                if seen[b]:
+                    return b
+                b = parent[match[b]]
+
+        def mark_path(v, stem, child, blossom):
+            while base[v] != stem:
+                blossom[base[v]] = blossom[base[match[v]]] = True
+                parent[v] = child
+                child = match[v]
+                v = parent[match[v]]
+
+        head = 0
+        while head < len(queue):
+            v = queue[head]
+            head += 1
+            for w in neighbors[v]:
+                if base[v] == base[w] or match[v] == w:
+                    continue
+                if w == root or (match[w] != -1 and parent[match[w]] != -1):
+                    stem = lca(v, w)
+                    blossom = [False] * num
+                    mark_path(v, stem, w, blossom)
+                    mark_path(w, stem, v, blossom)
+                    for u in range(num):
+                        if blossom[base[u]]:
+                            base[u] = stem
+                            if not used[u]:
+                                used[u] = True
+                                queue.append(u)
+                elif parent[w] == -1:
+                    parent[w] = v
+                    if match[w] == -1:
+                        return w, parent
+                    used[match[w]] = True
+                    queue.append(match[w])
+        return None, parent
+
+    for root in range(num):
+        if match[root] != -1:
+            continue
+        end, parent = find_path(root)
+        if end is None:
+            # Once a vertex cannot be augmented it never can be.
+            return None
+        while end != -1:
+            prev = parent[end]
+            following = match[prev]
+            match[end], match[prev] = prev, end
+            end = following
+    return match
+
+
+def _bottleneck(order, played):
+    """Finds the pairing without rematches whose largest gap in the ranking
+    between two opponents is the smallest possible: a binary search on the
+    allowed gap, checking each with a perfect matching.  Returns None if
+    every pairing has a rematch."""
+
+    def matching(gap):
+        neighbors = [
+            [
+                j
+                for j in range(max(0, i - gap), min(len(order), i + gap + 1))
+                if j != i and not played[order[i]] >> order[j] & 1
+            ]
+            for i in range(len(order))
+        ]
+        return _perfect_matching(len(order), neighbors)
+
+    low, high = 1, len(order) - 1
+    if matching(high) is None:
+        return None
+    while low < high:
+        gap = (low + high) // 2
+        if matching(gap) is None:
+            low = gap + 1
+        else:
+            high = gap
+    match = matching(low)
+    return [(order[i], order[j]) for i, j in enumerate(match) if i < j]
+
+
+def swiss(ranking, games):
+    """Returns the pairings of the next Swiss round as (home, away) pairs.
+    ranking lists the team indexes from first to last place and games the
+    (home, away) pairs of every game so far.
+
+    With an odd number of teams the bye goes to the lowest placed of the
+    teams with the fewest byes.  The others are paired top down within their
+    score groups, avoiding rematches.  If that gets stuck, the pairing
+    falls back to the one without rematches in which opponents are as close
+    as possible in the ranking, and rematches are only allowed when there
+    is no way to avoid them.  The team with fewer home games so far plays at
+    home."""
+    num_teams = max(ranking, default=-1) + 1
+    played, byes, homes = history(num_teams, games)
+    order = list(ranking)
+    bye = None
+    if len(order) % 2:
+        fewest = min(byes[team] for team in order)
+        bye = next(team for team in reversed(order) if byes[team] == fewest)
+        order.remove(bye)
+    pairs = _greedy(order, played) or _bottleneck(order, played)
+    if pairs is None:
+        pairs = list(zip(order[::2], order[1::2]))
+    position = {team: idx for idx, team in enumerate(order)}
+    pairs.sort(key=lambda pair: position[pair[0]])
+    pairs = [
+        (first, second) if homes[first] <= homes[second] else (second, first)
+        for first, second in pairs
+    ]
+    if bye is not None:
+        pairs.append((bye, BYE))
+    return pairs
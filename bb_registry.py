@@ -0,0 +1,146 @@
+#! python3
+"""This module implements the registry the bot uses to serve several
+tournaments from one process.  A map file ties Discord guilds (or single
+channels of a guild) to tournament data files.  Tournaments are only parsed
+when first used and are kept in a least recently used cache with a
+configurable size, and the ones left idle for too long are dropped, so
+memory and startup time stay bounded whatever the number of communities.
+
+The map file is YAML, keyed by guild id or 'guild id/channel id' (a channel
+entry wins over the guild entry).  Example:
+
+    "662926998471835648":
+      file: leagues/casual.yaml
+    "662926998471835648/662927124573323264":
+      file: leagues/open.db
+      backend: sqlite
+      name: spring
+"""
+import collections
+import time
+import yaml
+import bb_async
+import bb_tournament
+
+
+################################################################################
+class TourneyRegistry:
+    """Class maps guilds and channels to asynchronous tournament facades,
+    loading the tournaments lazily.  Guilds sharing a data file share the
+    same cached tournament."""
+
+    def __init__(
+        self,
+        map_file=None,
+        default=None,
+        executor=None,
+        capacity=16,
+        idle_seconds=3600,
+        journal=False,
+    ):
+        """default is the tournament (a dictionary in the map file format)
+        used for guilds and channels that are not in the map."""
+        self.routes = {}
+        if map_file is not None:
+            with open(map_file, "r") as f:
+                routes = yaml.load(f, Loader=bb_tournament.YAML_LOADER) or {}
+            self.routes = {str(key): spec for key, spec in routes.items()}
+        self.default = default
+        self.executor = executor or bb_async.create_executor()
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.journal = journal
+        # (backend, file, name) -> [facade, time of last use], oldest first
+        self.cache = collections.OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def route(self, guild_id, channel_id=None):
+        """Returns the tournament specification for a guild and channel, or
+        None if there is none."""
+        spec = None
+        if guild_id is not None:
+            spec = self.routes.get(f"{guild_id}/{channel_id}") or self.routes.get(
+                str(guild_id)
+            )
+        return spec or self.default
+
+    @staticmethod
+    def _key(spec):
+        """Cache key of a tournament specification."""
+        return (
+            spec.get("backend", "yaml"),
+            spec["file"],
+            spec.get("name", "default"),
+        )
+
+    def _open(self, key):
+        """Builds the facade for a tournament.  No file is read here, that
+        happens with the first command using it."""
+        backend, filename, name = key
+        if backend == "sqlite":
+            # Imported here since bb_store is only needed for that backend.
+            import bb_store
+
+            data = bb_store.TourneyStore(filename, name)
+        else:
+            data = bb_tournament.TourneyFile(
+                filename, resident=True, journal=self.journal
+            )
+        self.loads += 1
+        return bb_async.AsyncTourneyFile(data, self.executor)
+
+    def get(self, guild_id, channel_id=None):
+        """Returns the tournament facade for a guild and channel (None when
+        none is configured), marking it as most recently used.  Idle
+        tournaments are evicted first, and the least recently used one when
+        the cache is full."""
+        spec = self.route(guild_id, channel_id)
+        if spec is None:
+            return None
+        now = time.monotonic()
+        self.evict_idle(now)
+        key = self._key(spec)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = [self._open(key), now]
+            while len(self.cache) > self.capacity:
+                _, (facade, _) = self.cache.popitem(last=False)
+                facade.close()
+                self.evictions += 1
+        entry = self.cache[key]
+        entry[1] = now
+        return entry[0]
+
+    def evict_idle(self, now=None):
+        """Drops the tournaments which have not been used for idle_seconds.
+        Everything is on disk already, so nothing needs to be written, but
+        database connections are closed.  The cache is in order of use, so
+        only the oldest entries are looked at."""
+        now = time.monotonic() if now is None else now
+        while self.cache:
+            key, (facade, last_used) = next(iter(self.cache.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self.cache[key]
+            facade.close()
+            self.evictions += 1
+
+    def facades(self):
+        """Returns the facades of the cached tournaments, least recently used
+        first."""
+        return [facade for facade, _ in self.cache.values()]
+
+    def report(self):
+        """Returns a string describing the cached tournaments."""
+        now = time.monotonic()
+        lines = [
+            f"Tournaments cached: {len(self.cache)}/{self.capacity} "
+            f"loads: {self.loads} evictions: {self.evictions}"
+        ]
+        for (backend, filename, name), (_, last_used) in self.cache.items():
+            lines.append(
+                f"{filename} ({backend}, {name}) idle {now - last_used:.0f} s"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,449 @@
+#! python3
+"""This module implements the SQLite backend for Blood Bowl tournament data.
+TourneyStore offers the same public methods as bb_tournament.TourneyFile on
+top of the bb_db schema, so reports become indexed queries instead of a parse
+of the whole YAML file.  Team and game numbers are the same as in the YAML
+file: the order in which teams were added to the tournament, and the order in
+which games were added to a week."""
+import bb_db
+import bb_pairing
+import sql_strings as sqlstr
+from bb_tournament import (
+    Game,
+    League,
+    Schedule,
+    Team,
+    TourneyFile,
+    Week,
+    team_report,
+)
+
+
+################################################################################
+class TourneyStore:
+    """Class encapsulates interactions with one tournament in the database.
+    Reports run on the calling thread's read-only connection and never wait
+    for a write in progress, mutations go through the single writer."""
+
+    # Report methods may be called concurrently (see bb_async).
+    concurrent_reads = True
+
+    def __init__(self, filename, name="default", bb_ver=2, manager=None):
+        self.filename = filename
+        self.name = name
+        self.bb_ver = bb_ver
+        # A manager given by the caller is the caller's to close.
+        self.own_manager = manager is None
+        self.manager = manager or bb_db.ConnectionManager(filename)
+        self.tourney_id = None
+        self.num_weeks = 0
+        self.current_week = 0
+
+    def create(self):
+        """Creates the database tables (if needed) and the tournament."""
+        with self.manager.writing() as db_conn:
+            bb_db.init_tables(db_conn)
+            c = db_conn.cursor()
+            c.execute(sqlstr.count_gamestates_cmd)
+            if c.fetchone()[0] == 0:
+                bb_db.init_enum_tables(db_conn)
+            c.execute(sqlstr.select_tournament_cmd, (self.name,))
+            if c.fetchone() is None:
+                c.execute(sqlstr.insert_tournament_cmd, (self.name, self.bb_ver))
+
+    def close(self):
+        """Closes the database connections of the tournament."""
+        if self.own_manager:
+            self.manager.close()
+
+    def _tournament(self, db_conn):
+        """Returns the (id, number of weeks, current week) of the tournament.
+        Operations work on these values rather than on the attributes, which
+        other threads may be updating."""
+        c = db_conn.cursor()
+        c.execute(sqlstr.select_tournament_cmd, (self.name,))
+        row = c.fetchone()
+        if row is None:
+            raise ValueError(f"Tournament {self.name} not found in {self.filename}")
+        self.tourney_id, self.num_weeks, self.current_week = row
+        return row
+
+    def load(self):
+        """Looks up the tournament and its week counters."""
+        with self.manager.reading() as db_conn:
+            self._tournament(db_conn)
+
+    def read(self):
+        """Builds the League and Schedule objects from the database (the
+        equivalent of a full YAML read)."""
+        with self.manager.reading() as db_conn:
+            tourney = self._tournament(db_conn)
+            league, index = self._league(db_conn, tourney)
+            return league, self._schedule(db_conn, tourney, league, index), tourney[2]
+
+    @staticmethod
+    def _league(db_conn, tourney):
+        """Returns the League of the tournament and a dictionary mapping the
+        tournament_teams ids to team indexes."""
+        c = db_conn.cursor()
+        c.execute(sqlstr.select_tournament_teams_cmd, (tourney[0],))
+        league = League()
+        index = {}
+        for tt_id, name, race, coach, dtag in c.fetchall():
+            index[tt_id] = len(league)
+            league.append(Team(name, race, coach, dtag))
+        return league, index
+
+    @staticmethod
+    def _game(row, league, index):
+        """Builds a Game object from a games table row."""
+        _, home_id, visitor_id, home_score, visitor_score = row
+        game = Game(
+            {
+                "home": index[home_id],
+                "away": 9999 if visitor_id is None else index[visitor_id],
+                "result": {
+                    "home": -1 if home_score is None else home_score,
+                    "away": -1 if visitor_score is None else visitor_score,
+                },
+            }
+        )
+        game.add_team_data(league)
+        return game
+
+    def _schedule(self, db_conn, tourney, league, index):
+        """Builds the full Schedule of the tournament."""
+        tourney_id, num_weeks, current_week = tourney
+        schedule = Schedule()
+        for _ in range(num_weeks):
+            schedule.add_week()
+        c = db_conn.cursor()
+        c.execute(sqlstr.select_all_games_cmd, (tourney_id,))
+        for row in c:
+            schedule[row[0]].append(self._game(row, league, index))
+        if current_week < len(schedule):
+            schedule[current_week].current = True
+        schedule.rebuild_standings()
+        return schedule
+
+    def _race_id(self, db_conn, race):
+        """Returns the id of a race, adding it to the table if it is new."""
+        c = db_conn.cursor()
+        c.execute(sqlstr.select_race_cmd, (race, self.bb_ver))
+        row = c.fetchone()
+        if row is not None:
+            return row[0]
+        c.execute(sqlstr.insert_race_cmd, (race, self.bb_ver))
+        return c.lastrowid
+
+    @staticmethod
+    def _coach_id(db_conn, coach, dtag):
+        """Returns the id of a coach, adding them if they are new.  The
+        Discord id is not known from the team string."""
+        c = db_conn.cursor()
+        c.execute(sqlstr.select_coach_cmd, (coach, dtag))
+        row = c.fetchone()
+        if row is not None:
+            return row[0]
+        c.execute(sqlstr.insert_coach_cmd, (coach, dtag, 0))
+        return c.lastrowid
+
+    def add_team(self, team_str):
+        """Encapsulated team addition method."""
+        team = Team.from_str(team_str)
+        with self.manager.writing() as db_conn:
+            tourney_id = self._tournament(db_conn)[0]
+            c = db_conn.cursor()
+            c.execute(
+                sqlstr.insert_team_cmd,
+                (
+                    team.name,
+                    self.bb_ver,
+                    self._race_id(db_conn, team.race),
+                    self._coach_id(db_conn, team.coach, team.dtag),
+                ),
+            )
+            c.execute(
+                sqlstr.insert_tournament_team_cmd,
+                (self.bb_ver, tourney_id, c.lastrowid),
+            )
+            c.execute(sqlstr.update_num_teams_cmd, (1, tourney_id))
+
+    def del_team(self, team_name):
+        """Encapsulated team deletion method.  Teams with games scheduled
+        are kept, since the games would otherwise point to nothing."""
+        with self.manager.writing() as db_conn:
+            tourney_id = self._tournament(db_conn)[0]
+            c = db_conn.cursor()
+            c.execute(sqlstr.select_tournament_teams_cmd, (tourney_id,))
+            for tt_id, name, _, _, _ in c.fetchall():
+                if name == team_name:
+                    c.execute(sqlstr.count_team_games_cmd, (tt_id, tt_id))
+                    if c.fetchone()[0]:
+                        print(f"Team {team_name} has games scheduled and cannot be removed!")
+                        return
+                    c.execute(sqlstr.delete_tournament_team_cmd, (tt_id,))
+                    c.execute(sqlstr.update_num_teams_cmd, (-1, tourney_id))
+                    break
+            else:
+                print(f"Team {team_name} not found!")
+
+    def add_week(self):
+        """Adds a blank week to the schedule."""
+        with self.manager.writing() as db_conn:
+            tourney_id = self._tournament(db_conn)[0]
+            db_conn.execute(sqlstr.update_num_rounds_cmd, (tourney_id,))
+
+    def add_games(self, game_list):
+        """Receives a list of integers in strings.  Proceeds to create games
+        out of this list and add it to the last week in the schedule.  The
+        single word 'swiss' pairs the next Swiss round instead."""
+        swiss = list(game_list) == ["swiss"]
+        if not swiss:
+            game_list = list(map(int, game_list))
+        with self.manager.writing() as db_conn:
+            tourney = self._tournament(db_conn)
+            tourney_id, num_weeks, _ = tourney
+            if num_weeks == 0:
+                raise IndexError("The schedule has no week to add games to.")
+            if swiss:
+                league, index = self._league(db_conn, tourney)
+                schedule = self._schedule(db_conn, tourney, league, index)
+                game_list = schedule.swiss_games(len(league))
+            c = db_conn.cursor()
+            c.execute(sqlstr.select_tournament_teams_cmd, (tourney_id,))
+            tt_ids = [row[0] for row in c.fetchall()]
+            rows = []
+            for idx in range(0, len(game_list), 2):
+                home_id = tt_ids[game_list[idx]]
+                visitor_id = None
+                if idx != len(game_list) - 1:
+                    visitor_id = tt_ids[game_list[idx + 1]]
+                rows.append(
+                    (self.bb_ver, tourney_id, num_weeks - 1, home_id, visitor_id)
+                )
+            c.executemany(sqlstr.insert_game_cmd, rows)
+
+    def generate_round_robin(self, double=False, start_week=None):
+        """Generates a whole round robin season for the current teams, as
+        TourneyFile.generate_round_robin does, in a single transaction."""
+        with self.manager.writing() as db_conn:
+            tourney_id, num_weeks, _ = self._tournament(db_conn)
+            week_idx = num_weeks if start_week is None else start_week - 1
+            if week_idx < 0:
+                raise ValueError("The start week must be 1 or more.")
+            c = db_conn.cursor()
+            c.execute(sqlstr.select_tournament_teams_cmd, (tourney_id,))
+            tt_ids = [row[0] for row in c.fetchall()]
+            rounds = bb_pairing.round_robin(len(tt_ids), double)
+            c.executemany(
+                sqlstr.insert_game_cmd,
+                (
+                    (
+                        self.bb_ver,
+                        tourney_id,
+                        week_idx + offset,
+                        tt_ids[home],
+                        None if away == bb_pairing.BYE else tt_ids[away],
+                    )
+                    for offset, pairs in enumerate(rounds)
+                    for home, away in pairs
+                ),
+            )
+            c.execute(
+                sqlstr.extend_num_rounds_cmd, (week_idx + len(rounds), tourney_id)
+            )
+
+    def add_result(self, result_list):
+        """Receives a list of integers in strings.  Records the result of the
+        game in the current week."""
+        game_num, home_score, away_score = map(int, result_list)
+        played = home_score != -1 and away_score != -1
+        with self.manager.writing() as db_conn:
+            tourney_id, _, current_week = self._tournament(db_conn)
+            c = db_conn.cursor()
+            c.execute(
+                sqlstr.select_round_game_cmd, (tourney_id, current_week, game_num)
+            )
+            row = c.fetchone()
+            if row is None:
+                raise IndexError(f"No game {game_num} in the current week.")
+            c.execute(
+                sqlstr.update_game_result_cmd,
+                (
+                    home_score if home_score != -1 else None,
+                    away_score if away_score != -1 else None,
+                    2 if played else 1,
+                    row[0],
+                ),
+            )
+
+    def _move_week(self, step):
+        """Moves the current week by step, within the schedule."""
+        with self.manager.writing() as db_conn:
+            tourney_id, num_weeks, current_week = self._tournament(db_conn)
+            if 0 <= current_week + step < num_weeks:
+                db_conn.execute(
+                    sqlstr.update_current_round_cmd, (current_week + step, tourney_id)
+                )
+
+    def incr_week(self):
+        """Method to increment the current week."""
+        self._move_week(1)
+
+    def decr_week(self):
+        """Method to decrement the current week."""
+        self._move_week(-1)
+
+    def report_teams_long(self):
+        """Method to print a report for the team data."""
+        with self.manager.reading() as db_conn:
+            print(self._league(db_conn, self._tournament(db_conn))[0].long_report)
+
+    def report_teams_short(self):
+        """Produces a condensed team name only list of the current teams"""
+        with self.manager.reading() as db_conn:
+            return self._league(db_conn, self._tournament(db_conn))[0].short_report
+
+    def report_full_schedule(self):
+        """Returns a report of the whole schedule."""
+        with self.manager.reading() as db_conn:
+            tourney = self._tournament(db_conn)
+            league, index = self._league(db_conn, tourney)
+            return self._schedule(db_conn, tourney, league, index).full_report
+
+    def report_current_week(self):
+        """Returns a report of the current week of the schedule, fetching
+        only that week's games."""
+        with self.manager.reading() as db_conn:
+            tourney = self._tournament(db_conn)
+            tourney_id, num_weeks, current_week = tourney
+            if current_week >= num_weeks:
+                return ""
+            league, index = self._league(db_conn, tourney)
+            c = db_conn.cursor()
+            c.execute(sqlstr.select_round_games_cmd, (tourney_id, current_week))
+            week = Week()
+            week.current = True
+            for row in c:
+                week.append(self._game(row, league, index))
+            return week.report(current_week)
+
+    def report_team(self, team):
+        """Returns the games of a single team (given by name or index)."""
+        with self.manager.reading() as db_conn:
+            tourney = self._tournament(db_conn)
+            league, index = self._league(db_conn, tourney)
+            team_idx = league.find(team)
+            tt_id = next(tt_id for tt_id, idx in index.items() if idx == team_idx)
+            c = db_conn.cursor()
+            c.execute(sqlstr.select_team_games_cmd, (tt_id, tt_id))
+            games = [
+                (row[0], row[1], self._game(row[:1] + row[2:], league, index))
+                for row in c
+            ]
+            return team_report(league[team_idx], games)
+
+    def report_standings(self):
+        """Returns the league standings."""
+        with self.manager.reading() as db_conn:
+            tourney = self._tournament(db_conn)
+            league, index = self._league(db_conn, tourney)
+            schedule = self._schedule(db_conn, tourney, league, index)
+            return schedule.standings.report(league)
+
+
+################################################################################
+def _new_ids(c, table, rows_before):
+    """Returns the ids of the rows inserted in a table after the given
+    maximum id, in insertion order."""
+    c.execute(sqlstr.select_ids_after_cmd.format(table), (rows_before,))
+    return [row[0] for row in c.fetchall()]
+
+
+def _max_id(c, table):
+    """Returns the highest id of a table (0 when empty)."""
+    c.execute(sqlstr.select_max_id_cmd.format(table))
+    return c.fetchone()[0]
+
+
+def migrate_yaml(db_conn, yaml_file, name, bb_ver=2):
+    """Loads a YAML tournament file (journal included) into the database as
+    the tournament 'name'.  Rows are inserted table by table with executemany
+    and nothing is committed: the caller decides the transaction boundaries.
+    The inserted row counts are checked against the file, and returned as a
+    (teams, games) tuple."""
+    league, schedule, current_week = TourneyFile(yaml_file).read()
+    c = db_conn.cursor()
+    c.execute(sqlstr.select_tournament_cmd, (name,))
+    if c.fetchone() is not None:
+        raise ValueError(f"Tournament {name} already exists.")
+
+    # Enumerations and coaches shared with other tournaments are reused.
+    c.execute(sqlstr.select_races_cmd, (bb_ver,))
+    races = dict(c.fetchall())
+    new_races = sorted({team.race for team in league} - set(races))
+    c.executemany(sqlstr.insert_race_cmd, [(race, bb_ver) for race in new_races])
+    c.execute(sqlstr.select_races_cmd, (bb_ver,))
+    races = dict(c.fetchall())
+
+    c.execute(sqlstr.select_coaches_cmd)
+    coaches = {(coach, dtag): coach_id for coach, dtag, coach_id in c.fetchall()}
+    new_coaches = sorted({(team.coach, team.dtag) for team in league} - set(coaches))
+    c.executemany(
+        sqlstr.insert_coach_cmd, [(coach, dtag, 0) for coach, dtag in new_coaches]
+    )
+    c.execute(sqlstr.select_coaches_cmd)
+    coaches = {(coach, dtag): coach_id for coach, dtag, coach_id in c.fetchall()}
+
+    before = _max_id(c, "teams")
+    c.executemany(
+        sqlstr.insert_team_cmd,
+        [
+            (team.name, bb_ver, races[team.race], coaches[(team.coach, team.dtag)])
+            for team in league
+        ],
+    )
+    team_ids = _new_ids(c, "teams", before)
+
+    c.execute(
+        sqlstr.insert_migrated_tournament_cmd,
+        (name, bb_ver, len(league), len(schedule), current_week),
+    )
+    tourney_id = c.lastrowid
+
+    before = _max_id(c, "tournament_teams")
+    c.executemany(
+        sqlstr.insert_tournament_team_cmd,
+        [(bb_ver, tourney_id, team_id) for team_id in team_ids],
+    )
+    tt_ids = _new_ids(c, "tournament_teams", before)
+
+    rows = []
+    for week_idx, week in enumerate(schedule):
+        for game in week:
+            home_score, away_score = game.result["home"], game.result["away"]
+            rows.append(
+                (
+                    bb_ver,
+                    tourney_id,
+                    week_idx,
+                    tt_ids[game.home_index],
+                    None if game.away_index == 9999 else tt_ids[game.away_index],
+                    2 if game.played else 1,
+                    None if home_score == -1 else home_score,
+                    None if away_score == -1 else away_score,
+                )
+            )
+    c.executemany(sqlstr.insert_migrated_game_cmd, rows)
+
+    c.execute(sqlstr.count_tournament_teams_cmd, (tourney_id,))
+    num_teams = c.fetchone()[0]
+    c.execute(sqlstr.count_tournament_games_cmd, (tourney_id,))
+    num_games = c.fetchone()[0]
+    if num_teams != len(league) or num_games != len(rows):
+        raise ValueError(
+            f"Migration of {yaml_file} inserted {num_teams} teams and "
+            f"{num_games} games, expected {len(league)} and {len(rows)}."
+        )
+    return num_teams, num_games
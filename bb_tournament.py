@@ -3,7 +3,17 @@
 team names and league schedules in order to facilitate command line operation
 and a Discord Bot API in the future."""
 import argparse
+import itertools
+import json
+import os
+import threading
 import yaml
+import bb_pairing
+
+# The libyaml based loader and dumper are several times faster, when they
+# are available.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
 ################################################################################
 class Team:
@@ -75,6 +85,42 @@ class League(list):
         that is built up into the final overall YAML structure."""
         return [team.yaml for team in self]
 
+    @property
+    def short_report(self):
+        """Returns a string containing a condensed team name only list of
+        the teams."""
+        lines = []
+        for idx, team in enumerate(self):
+            lines.append(f"{idx:2}: Name: {team.name:30} Coach: {team.coach:15} Tag: {team.dtag:10}")
+        return "\n".join(lines)
+
+    def find(self, team):
+        """Returns the index of a team given either its index or its name
+        (case is ignored if no name matches exactly).  Raises ValueError if
+        there is no such team."""
+        team = str(team).strip()
+        if team.isdigit() and int(team) < len(self):
+            return int(team)
+        names = [entry.name for entry in self]
+        if team in names:
+            return names.index(team)
+        lowered = [name.lower() for name in names]
+        if team.lower() in lowered:
+            return lowered.index(team.lower())
+        raise ValueError(f"Team {team} not found!")
+
+    @property
+    def long_report(self):
+        """Returns a string containing every detail of every team."""
+        lines = [f"Number of teams: {len(self)}"]
+        for idx, team in enumerate(self):
+            lines.append(f"-- Team #{idx} ---------------------------")
+            lines.append(f"Team Name: {team.name}")
+            lines.append(f"Team Race: {team.race}")
+            lines.append(f"Coach Name: {team.coach}")
+            lines.append(f"Coach Discord Tag: {team.dtag}")
+        return "\n".join(lines)
+
 
 ################################################################################
 class Game:
@@ -108,17 +154,27 @@ class Game:
         else:
             self.away = league[self.away_index]
 
-    def add_result(self, result_list):
+    def add_result(self, result_list, standings=None):
         """Gets a list of scores [home, away] and sets the instances
-        values accordingly."""
+        values accordingly.  When given the standings, the previous result
+        (if any) is taken out of them and the new one counted in."""
+        if standings is not None:
+            standings.remove_game(self)
         self.result["home"] = result_list[0]
         self.result["away"] = result_list[1]
+        self.played = self.result["home"] != -1 and self.result["away"] != -1
+        if standings is not None:
+            standings.add_game(self)
 
     @property
     def yaml(self):
         """Returns a dictionary object to be used to create the data structure
         that is built up into the final overall YAML structure."""
-        return {"home": self.home_index, "away": self.away_index, "result": self.result}
+        return {
+            "home": self.home_index,
+            "away": self.away_index,
+            "result": dict(self.result),
+        }
 
     def __str__(self):
         if self.played:
@@ -126,6 +182,140 @@ class Game:
         return f"Home: {self.home.name:25} Away: {self.away.name:25}"
 
 
+################################################################################
+class Record:
+    """Class holds the running totals of a single team in the standings, and
+    how many times it has played each opponent."""
+
+    def __init__(self):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.points = 0
+        self.td_for = 0
+        self.td_against = 0
+        self.opponents = {}
+
+    @property
+    def td_diff(self):
+        """Touchdown difference."""
+        return self.td_for - self.td_against
+
+    def update(self, scored, conceded, points, opponent, sign=1):
+        """Counts one game in (sign 1) or out (sign -1) of the record."""
+        if scored > conceded:
+            self.wins += sign
+        elif scored == conceded:
+            self.draws += sign
+        else:
+            self.losses += sign
+        self.points += sign * points
+        self.td_for += sign * scored
+        self.td_against += sign * conceded
+        self.opponents[opponent] = self.opponents.get(opponent, 0) + sign
+
+
+class Standings(dict):
+    """A dictionary of team index to Record, plus the points every team took
+    off every other team.  A result is counted in or out with a constant
+    amount of work.  The tiebreakers (points, touchdown difference, head to
+    head, strength of schedule) are only worked out when ranking."""
+
+    POINTS = {"win": 3, "draw": 1, "loss": 0}
+
+    def __init__(self):
+        super().__init__()
+        self.head_to_head = {}
+
+    def record(self, team_idx):
+        """Returns the Record of a team, creating an empty one if needed."""
+        if team_idx not in self:
+            self[team_idx] = Record()
+        return self[team_idx]
+
+    def points(self, scored, conceded):
+        """Standings points earned by a score."""
+        if scored > conceded:
+            return self.POINTS["win"]
+        if scored == conceded:
+            return self.POINTS["draw"]
+        return self.POINTS["loss"]
+
+    def add_game(self, game, sign=1):
+        """Counts a game result in the standings (out of them with a sign of
+        -1).  Unplayed games and byes are ignored."""
+        if not game.played or game.away_index == 9999:
+            return
+        home, away = game.home_index, game.away_index
+        home_score, away_score = game.result["home"], game.result["away"]
+        home_points = self.points(home_score, away_score)
+        away_points = self.points(away_score, home_score)
+        self.record(home).update(home_score, away_score, home_points, away, sign)
+        self.record(away).update(away_score, home_score, away_points, home, sign)
+        for pair, points in (((home, away), home_points), ((away, home), away_points)):
+            self.head_to_head[pair] = self.head_to_head.get(pair, 0) + sign * points
+
+    def remove_game(self, game):
+        """Takes a game result back out of the standings."""
+        self.add_game(game, -1)
+
+    def _head_to_head(self, team_idx, group):
+        """Points a team took off the other teams of a tied group."""
+        return sum(
+            self.head_to_head.get((team_idx, other), 0)
+            for other in group
+            if other != team_idx
+        )
+
+    def _strength(self, team_idx):
+        """Strength of schedule, the points of every opponent faced (counted
+        once per game played against them)."""
+        return sum(
+            self.record(opponent).points * games
+            for opponent, games in self.record(team_idx).opponents.items()
+        )
+
+    def ranking(self, num_teams):
+        """Returns the team indexes from first to last.  Teams are sorted on
+        points and touchdown difference, and only the teams still tied after
+        that get the head to head and strength of schedule tiebreakers."""
+
+        def primary(team_idx):
+            record = self.record(team_idx)
+            return (record.points, record.td_diff)
+
+        ranked = []
+        order = sorted(range(num_teams), key=primary, reverse=True)
+        for _, group in itertools.groupby(order, key=primary):
+            group = list(group)
+            if len(group) > 1:
+                group.sort(
+                    key=lambda idx: (
+                        self._head_to_head(idx, group),
+                        self._strength(idx),
+                    ),
+                    reverse=True,
+                )
+            ranked.extend(group)
+        return ranked
+
+    def report(self, league):
+        """Returns a string containing the standings of the league."""
+        points = self.POINTS
+        lines = [
+            f"Standings (Win {points['win']}, Draw {points['draw']}, Loss {points['loss']})"
+        ]
+        for rank, team_idx in enumerate(self.ranking(len(league)), 1):
+            record = self.record(team_idx)
+            lines.append(
+                f"{rank:2}: {league[team_idx].name:30} "
+                f"W: {record.wins:2} D: {record.draws:2} L: {record.losses:2} "
+                f"TD: {record.td_for:3}-{record.td_against:<3} ({record.td_diff:+}) "
+                f"Pts: {record.points:3}"
+            )
+        return "\n".join(lines)
+
+
 class Week(list):
     """Class that encapsulates the data pertaining to a single week in a
     tournament structure."""
@@ -144,10 +334,10 @@ class Week(list):
         for game in game_list:
             self.append(Game(game))
 
-    def add_result(self, result_list):
+    def add_result(self, result_list, standings=None):
         """Gets a list of values for a game result.  [Game num, home score,
         away score] and calls the game's method to set those values."""
-        self[result_list[0]].add_result(result_list[1:])
+        self[result_list[0]].add_result(result_list[1:], standings)
 
     @property
     def yaml(self):
@@ -155,6 +345,11 @@ class Week(list):
         that is built up into the final overall YAML structure."""
         return [game.yaml for game in self]
 
+    def report(self, week_idx):
+        """Returns a string containing the report of this week, labeled as
+        week week_idx of the schedule."""
+        return f"-- Week: {week_idx+1} --{self}"
+
     def __str__(self):
         if self.current:
             lines = [" Current " + "-" * 63]
@@ -176,6 +371,16 @@ class Schedule(list):
         schedule_dict = schedule_dict or {}
         for week in schedule_dict:
             self.append(Week(schedule_dict[week]))
+        self.rebuild_standings()
+
+    def rebuild_standings(self):
+        """Counts every played game into fresh standings.  Only needed when
+        games are added with results already in them, otherwise add_result
+        keeps the standings up to date."""
+        self.standings = Standings()
+        for week in self:
+            for game in week:
+                self.standings.add_game(game)
 
     def add_week(self):
         """Adds a blank week object to the schedule."""
@@ -190,7 +395,29 @@ class Schedule(list):
         """Receives a list representing the result of a game, as well as the
         week to apply the result to and call's the appropriate week object's
         method to set the game result."""
-        self[week_num].add_result(result_list)
+        self[week_num].add_result(result_list, self.standings)
+
+    def swiss_games(self, num_teams):
+        """Returns the next Swiss round for the last week, paired from the
+        standings, as a list of team indexes in the add_games format.  Teams
+        already playing in the last week are left out."""
+        busy = {
+            team_idx
+            for game in self[-1]
+            for team_idx in (game.home_index, game.away_index)
+        }
+        ranking = [
+            team_idx
+            for team_idx in self.standings.ranking(num_teams)
+            if team_idx not in busy
+        ]
+        games = [(game.home_index, game.away_index) for week in self for game in week]
+        game_list = []
+        for home, away in bb_pairing.swiss(ranking, games):
+            game_list.append(home)
+            if away != bb_pairing.BYE:
+                game_list.append(away)
+        return game_list
 
     @property
     def yaml(self):
@@ -224,16 +451,14 @@ class Schedule(list):
         week)"""
         lines = [f"Number of weeks in the schedule: {len(self)}"]
         for week_idx, week in enumerate(self):
-            lines.append(f"-- Week: {week_idx+1} --{week}")
+            lines.append(week.report(week_idx))
         return "\n".join(lines)
 
     def week_report(self, week_num):
         """Returns a string containing a single week report"""
-        lines = []
-        for week_idx, week in enumerate(self):
-            if week_idx == week_num:
-                lines.append(f"-- Week: {week_idx+1} --{week}")
-        return "\n".join(lines)
+        if 0 <= week_num < len(self):
+            return self[week_num].report(week_num)
+        return ""
 
     def __str__(self):
         lines = [f"Number of weeks in the schedule: {len(self)}"]
@@ -242,121 +467,445 @@ class Schedule(list):
         return "\n".join(lines)
 
 
+def team_report(team, games):
+    """Returns a string listing the games of a team, games being a list of
+    (week index, game number, Game) in schedule order.  Byes are listed
+    but not counted as games."""
+    byes = sum(1 for _, _, game in games if game.away_index == 9999)
+    header = f"Games for {team.name}: {len(games) - byes}"
+    if byes:
+        header += f" (byes: {byes})"
+    lines = [header]
+    for week_idx, game_idx, game in games:
+        lines.append(f"Week: {week_idx+1:2} | Game: {game_idx} | {game}")
+    return "\n".join(lines)
+
+
+################################################################################
+class ReportCache:
+    """Class holds rendered report strings keyed by (report kind, parameters,
+    data version).  The data version of a report is built from the version
+    counters of the sections of the tournament data it depends on, so bumping
+    a section makes every report built from it miss, and those entries are
+    evicted right away."""
+
+    SECTIONS = ("teams", "schedule", "current_week")
+    DEPENDS = {
+        "teams_short": ("teams",),
+        "full_schedule": ("teams", "schedule", "current_week"),
+        "current_week": ("teams", "schedule", "current_week"),
+        "standings": ("teams", "schedule"),
+        "team": ("teams", "schedule"),
+    }
+
+    def __init__(self):
+        self.versions = dict.fromkeys(self.SECTIONS, 0)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, kind):
+        """Returns the data version a report kind is currently built from."""
+        return tuple(self.versions[section] for section in self.DEPENDS[kind])
+
+    def get(self, kind, params, render):
+        """Returns the cached report, calling render() to build and store it
+        if the current data version has not been rendered yet."""
+        key = (kind, params, self.version(kind))
+        try:
+            text = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            text = self.entries[key] = render()
+        else:
+            self.hits += 1
+        return text
+
+    def bump(self, *sections):
+        """Marks sections of the data as changed (all of them if none are
+        given) and evicts the reports depending on them."""
+        sections = sections or self.SECTIONS
+        for section in sections:
+            self.versions[section] += 1
+        self.entries = {
+            key: text
+            for key, text in self.entries.items()
+            if not set(self.DEPENDS[key[0]]).intersection(sections)
+        }
+
+
 ################################################################################
 class TourneyFile:
     """Class encapsulates interactions with the YAML file.  No one outside
     of this class ought to be exposed to THE BLOB."""
 
-    def __init__(self, filename):
+    JOURNAL_SUFFIX = ".journal"
+    COMPACT_SIZE = 64 * 1024
+
+    def __init__(self, filename, resident=False, journal=False, compact_size=None):
+        """In resident mode (meant for long running processes like the bot)
+        the parsed data is the authoritative state and the file is only
+        reparsed when something outside of this object has changed it.
+
+        In journal mode mutations are appended to a journal file next to the
+        YAML snapshot instead of rewriting it, and the journal is compacted
+        into a new snapshot in the background once it grows past
+        compact_size bytes.  The journal is replayed by every read, whatever
+        the mode."""
         self.filename = filename
+        self.journal_name = filename + self.JOURNAL_SUFFIX
+        self.resident = resident
+        self.journal = journal
+        self.compact_size = compact_size or self.COMPACT_SIZE
+        self.signature = None
+        self.seq = 0
         self.league = League()
         self.schedule = Schedule()
         self.current_week = 0
+        # Team index -> list of (week index, game number) it plays in.
+        self.team_games = {}
+        self.reports = ReportCache()
+        self._lock = threading.Lock()
+        self._compactor = None
+
+    @staticmethod
+    def _signature(stat):
+        """Builds the value used to detect outside changes to the file."""
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _journal_signature(self):
+        """Signature of the journal file, None when there is none."""
+        try:
+            return self._signature(os.stat(self.journal_name))
+        except FileNotFoundError:
+            return None
 
     def read(self):
-        """Reading the YAML file and parsing the results.  Have to check
-        to make sure fields are populated before creating the data structures.
-        """
+        """Reading the YAML file and parsing the results, then replaying the
+        journal entries that are newer than the snapshot.  The list
+        initializers accept None for sections that are not populated yet."""
         with open(self.filename, "r") as f:
-            blob = yaml.safe_load(f)
-        # Checking the population of the blob against these keys.  The
-        # list initializer does not like None as an input.
-        if blob["teams"]:
-            self.league = League(blob["teams"])
-        if blob["current_week"]:
-            self.current_week = blob["current_week"]
-        if blob["schedule"]:
-            self.schedule = Schedule(blob["schedule"])
-            for week_idx, week in enumerate(self.schedule):
-                if week_idx == self.current_week:
-                    week.current = True
-                for game in week:
-                    game.add_team_data(self.league)
+            blob = yaml.load(f, Loader=YAML_LOADER)
+            snapshot_signature = self._signature(os.fstat(f.fileno()))
+        self.league = League(blob["teams"])
+        self.current_week = blob["current_week"] or 0
+        self.schedule = Schedule(blob["schedule"])
+        self.seq = blob.get("journal_seq", 0)
+        self._attach_teams()
+        self._replay()
+        self.signature = (snapshot_signature, self._journal_signature())
+        self.reports.bump()
         return self.league, self.schedule, self.current_week
 
+    def _replay(self):
+        """Applies the journal entries newer than the current state.  A torn
+        last line (from a crash in the middle of an append) is cut off the
+        file, otherwise the next append would be glued onto it and lost."""
+        try:
+            f = open(self.journal_name, "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            good_size = 0
+            for line, entry in self._journal_entries(f):
+                good_size += len(line)
+                if entry["seq"] > self.seq:
+                    self._operations[entry["op"]](self, *entry["args"])
+                    self.seq = entry["seq"]
+            if good_size < os.fstat(f.fileno()).st_size:
+                f.truncate(good_size)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _journal_entries(f):
+        """Yields (line, entry) for the lines of a journal file opened in
+        binary mode, stopping at the first line which is not complete or
+        does not parse."""
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                yield line, json.loads(line)
+            except ValueError:
+                return
+
+    def load(self):
+        """Makes sure the internal state reflects the file before an
+        operation.  Outside of resident mode this is always a full read,
+        in resident mode only when the snapshot or the journal has changed
+        since we last read or wrote them."""
+        with self._lock:
+            if not self.resident or self.signature is None:
+                self.read()
+                return
+            snapshot_signature = self._signature(os.stat(self.filename))
+            if (snapshot_signature, self._journal_signature()) != self.signature:
+                self.read()
+
+    def _attach_teams(self):
+        """Marks the current week, links every game to its Team objects and
+        rebuilds the index of the games of every team."""
+        self.team_games = {}
+        for week_idx, week in enumerate(self.schedule):
+            week.current = week_idx == self.current_week
+            for game_idx, game in enumerate(week):
+                game.add_team_data(self.league)
+                self._index_game(week_idx, game_idx, game)
+
+    def _index_game(self, week_idx, game_idx, game):
+        """Adds a game to the games index of both its teams."""
+        self.team_games.setdefault(game.home_index, []).append((week_idx, game_idx))
+        if game.away_index != 9999:
+            self.team_games.setdefault(game.away_index, []).append(
+                (week_idx, game_idx)
+            )
+
     def write(self, blob):
         """Encapsulated YAML writing method."""
         with open(self.filename, "w") as f:
-            yaml.dump(blob, f)
+            yaml.dump(blob, f, Dumper=YAML_DUMPER)
+            f.flush()
+            self.signature = (self._signature(os.fstat(f.fileno())), None)
 
     def create(self):
         """Encapsulated YAML initial file state method."""
         # blob = {"current_week": 0, "teams": None, "schedule": None}
         self.write(self.make_blob)
+        # A journal left over from an earlier file would be replayed onto
+        # the new one.
+        if os.path.exists(self.journal_name):
+            os.remove(self.journal_name)
+
+    def _commit(self, op, *args):
+        """Makes a mutation that has been applied in memory durable.  In
+        journal mode this is one appended (and fsynced) line, otherwise the
+        whole snapshot is rewritten and any journal is dropped since the
+        snapshot now covers it."""
+        if not self.journal:
+            self.write(self.make_blob)
+            if os.path.exists(self.journal_name):
+                os.remove(self.journal_name)
+            return
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "op": op, "args": args}) + "\n"
+        with self._lock:
+            with open(self.journal_name, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                journal_stat = os.fstat(f.fileno())
+            if self.signature is not None:
+                self.signature = (self.signature[0], self._signature(journal_stat))
+        if journal_stat.st_size > self.compact_size:
+            self.compact(background=True)
+
+    def compact(self, background=False):
+        """Folds the journal into a fresh snapshot.  The snapshot is built
+        from the in-memory state and written to a temporary file which then
+        replaces the old one, after which the journal entries it covers are
+        dropped.  With background set the writing happens on a thread, and
+        nothing is done if a compaction is already running."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        blob = self.make_blob
+        if background:
+            self._compactor = threading.Thread(
+                target=self._write_snapshot, args=(blob,), name="bb_compact"
+            )
+            self._compactor.start()
+        else:
+            self._write_snapshot(blob)
+
+    def _write_snapshot(self, blob):
+        """Writes the snapshot for compact(), then keeps only the journal
+        entries which were appended after the blob was built."""
+        seq = blob.get("journal_seq", 0)
+        temp_name = self.filename + ".tmp"
+        with open(temp_name, "w") as f:
+            yaml.dump(blob, f, Dumper=YAML_DUMPER)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            os.replace(temp_name, self.filename)
+            snapshot_signature = self._signature(os.stat(self.filename))
+            try:
+                with open(self.journal_name, "rb") as f:
+                    tail = [
+                        line
+                        for line, entry in self._journal_entries(f)
+                        if entry["seq"] > seq
+                    ]
+            except FileNotFoundError:
+                tail = []
+            with open(self.journal_name + ".tmp", "wb") as f:
+                f.writelines(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.journal_name + ".tmp", self.journal_name)
+            if self.signature is not None:
+                self.signature = (snapshot_signature, self._journal_signature())
 
     def add_team(self, team_str):
         """Encapsulated team addition method."""
-        self.read()
+        self.load()
+        self._add_team(team_str)
+        self._commit("add_team", team_str)
+
+    def _add_team(self, team_str):
+        """Applies the team addition to the in-memory state."""
         self.league.append(Team.from_str(team_str))
-        self.write(self.make_blob)
+        self.reports.bump("teams")
 
     def del_team(self, team_name):
         """Encapsulated team deletion method."""
-        self.read()
+        self.load()
         print(f"self.league is {self.league}")
+        if self._del_team(team_name):
+            self._commit("del_team", team_name)
+        else:
+            print(f"Team {team_name} not found!")
+
+    def _del_team(self, team_name):
+        """Applies the team deletion to the in-memory state, returns False if
+        the team was not found."""
         for idx, team in enumerate(self.league):
             if team.name == team_name:
                 del self.league[idx]
-                self.write(self.make_blob)
-                break
-        else:
-            print(f"Team {team_name} not found!")
+                # Team indexes after the deleted one have shifted.
+                self._attach_teams()
+                self.reports.bump("teams")
+                return True
+        return False
 
     def add_week(self):
         """Adds a blank week to the schedule."""
-        self.read()
+        self.load()
+        self._add_week()
+        self._commit("add_week")
+
+    def _add_week(self):
+        """Applies the week addition to the in-memory state."""
         self.schedule.add_week()
-        self.write(self.make_blob)
+        self.schedule[-1].current = len(self.schedule) - 1 == self.current_week
+        self.reports.bump("schedule")
 
     def add_games(self, game_list):
         """Receives a list of integers in strings.  Proceeds to create games
-        out of this list and add it to the last week in the schedule."""
-        self.read()
-        # Need to create a translation from the list of strings of numbers
-        # to the format the Game object wants.
-        game_list = list(map(int, game_list))
-        newlist = []
+        out of this list and add it to the last week in the schedule.  The
+        single word 'swiss' pairs the next Swiss round instead, the journal
+        records the resulting games."""
+        self.load()
+        if list(game_list) == ["swiss"]:
+            game_list = self.schedule.swiss_games(len(self.league))
+        else:
+            game_list = list(map(int, game_list))
+        self._add_games(game_list)
+        self._commit("add_games", game_list)
+
+    def _add_games(self, game_list):
+        """Applies the games addition to the in-memory state."""
+        # Pair up the list of numbers, a lone last number has a bye.
+        pairs = []
         for idx in range(0, len(game_list), 2):
             if idx != len(game_list) - 1:
-                newlist.append(
-                    {
-                        "home": game_list[idx],
-                        "away": game_list[idx + 1],
-                        "result": {"home": -1, "away": -1},
-                    }
-                )
+                pairs.append((game_list[idx], game_list[idx + 1]))
             else:
-                newlist.append(
-                    {
-                        "home": game_list[idx],
-                        "away": 9999,
-                        "result": {"home": -1, "away": -1},
-                    }
-                )
-        self.schedule.add_games(newlist)
-        self.write(self.make_blob)
+                pairs.append((game_list[idx], 9999))
+        self._append_games(len(self.schedule) - 1, pairs)
+        self.reports.bump("schedule")
+
+    def _append_games(self, week_idx, pairs):
+        """Adds games given as (home, away) index pairs to a week, linking
+        and indexing them."""
+        # Need to create a translation from the pairs to the format the Game
+        # object wants.
+        newlist = [
+            {"home": home, "away": away, "result": {"home": -1, "away": -1}}
+            for home, away in pairs
+        ]
+        self.schedule.add_games(newlist, week_idx)
+        week = self.schedule[week_idx]
+        for game_idx in range(len(week) - len(newlist), len(week)):
+            week[game_idx].add_team_data(self.league)
+            self._index_game(week_idx, game_idx, week[game_idx])
+
+    def generate_round_robin(self, double=False, start_week=None):
+        """Generates a whole round robin season (two with double set) for the
+        current teams.  The first round goes in start_week (counted from 1
+        as in the reports, by default the week after the last one) and weeks
+        are added as needed.  The season is built in memory and committed in
+        a single write (or journal entry)."""
+        self.load()
+        week_idx = len(self.schedule) if start_week is None else start_week - 1
+        if week_idx < 0:
+            raise ValueError("The start week must be 1 or more.")
+        rounds = bb_pairing.round_robin(len(self.league), double)
+        self._add_schedule(rounds, week_idx)
+        self._commit("add_schedule", rounds, week_idx)
+
+    def _add_schedule(self, rounds, week_idx):
+        """Applies the addition of rounds of (home, away) pairs starting at
+        week_idx to the in-memory state."""
+        while len(self.schedule) < week_idx + len(rounds):
+            self.schedule.add_week()
+            self.schedule[-1].current = len(self.schedule) - 1 == self.current_week
+        for offset, pairs in enumerate(rounds):
+            self._append_games(week_idx + offset, pairs)
+        self.reports.bump("schedule")
 
     def add_result(self, result_list):
         """Receives a list of integers in strings.  Calls the schedule
         object to record the result of the game."""
-        self.read()
+        self.load()
         result_list = list(map(int, result_list))
-        self.schedule.add_result(result_list, self.current_week)
-        self.write(self.make_blob)
+        self._add_result(result_list, self.current_week)
+        self._commit("add_result", result_list, self.current_week)
+
+    def _add_result(self, result_list, week_num):
+        """Applies the game result to the in-memory state."""
+        self.schedule.add_result(result_list, week_num)
+        self.reports.bump("schedule")
 
     def incr_week(self):
         """Method to increment the current week."""
-        self.read()
+        self.load()
+        self._incr_week()
+        self._commit("incr_week")
+
+    def _incr_week(self):
+        """Applies the week increment to the in-memory state."""
         if self.current_week < len(self.schedule) - 1:
+            self.schedule[self.current_week].current = False
             self.current_week += 1
-        self.write(self.make_blob)
+            self.schedule[self.current_week].current = True
+            self.reports.bump("current_week")
 
     def decr_week(self):
         """Method to increment the current week."""
-        self.read()
+        self.load()
+        self._decr_week()
+        self._commit("decr_week")
+
+    def _decr_week(self):
+        """Applies the week decrement to the in-memory state."""
         if self.current_week > 0:
+            self.schedule[self.current_week].current = False
             self.current_week -= 1
-        self.write(self.make_blob)
+            self.schedule[self.current_week].current = True
+            self.reports.bump("current_week")
+
+    # Journal operation names and the methods replaying them.
+    _operations = {
+        "add_team": _add_team,
+        "del_team": _del_team,
+        "add_week": _add_week,
+        "add_games": _add_games,
+        "add_schedule": _add_schedule,
+        "add_result": _add_result,
+        "incr_week": _incr_week,
+        "decr_week": _decr_week,
+    }
 
     @property
     def make_blob(self):
@@ -368,44 +917,71 @@ class TourneyFile:
         schedule_result = None
         if self.schedule is not None:
             schedule_result = self.schedule.yaml
-        return {
+        blob = {
             "current_week": self.current_week,
             "teams": teams_result,
             "schedule": schedule_result,
         }
+        if self.seq:
+            blob["journal_seq"] = self.seq
+        return blob
 
     def report_teams_long(self):
         """Method to print a report for the team data structures retrieved from the
         YAML file."""
-        self.read()
-        print(f"Number of teams: {len(self.league)}")
-        for idx, team in enumerate(self.league):
-            print(f"-- Team #{idx} ---------------------------")
-            print(f"Team Name: {team.name}")
-            print(f"Team Race: {team.race}")
-            print(f"Coach Name: {team.coach}")
-            print(f"Coach Discord Tag: {team.dtag}")
+        self.load()
+        print(self.league.long_report)
 
     def report_teams_short(self):
         """Produces a condensed team name only list of the current teams"""
-        self.read()
-        lines = []
-        for idx, team in enumerate(self.league):
-            lines.append(f"{idx:2}: Name: {team.name:30} Coach: {team.coach:15} Tag: {team.dtag:10}")
-        text = "\n".join(lines)
-        return text
+        self.load()
+        # League.short_report renders the list on every call, the cache keeps
+        # it until a team is added or deleted (the "teams" section).
+        return self.reports.get("teams_short", (), lambda: self.league.short_report)
 
     def report_full_schedule(self):
         """Method to print a report of the schedule data retrieved from the YAML
         file."""
-        self.read()
-        return self.schedule.full_report
+        self.load()
+        return self.reports.get(
+            "full_schedule", (), lambda: self.schedule.full_report
+        )
 
     def report_current_week(self):
         """Method to print a report of the current week of schedule data
         in the YAML file."""
-        self.read()
-        return self.schedule.week_report(self.current_week)
+        self.load()
+        return self.reports.get(
+            "current_week",
+            (self.current_week,),
+            lambda: self.schedule.week_report(self.current_week),
+        )
+
+    def report_team(self, team):
+        """Returns the games of a single team (given by name or index) across
+        every week.  Only that team's games are visited, through the index.
+        Results are read from the games themselves, so the index does not
+        change when one is recorded."""
+        self.load()
+        team_idx = self.league.find(team)
+        return self.reports.get(
+            "team",
+            (team_idx,),
+            lambda: team_report(
+                self.league[team_idx],
+                [
+                    (week_idx, game_idx, self.schedule[week_idx][game_idx])
+                    for week_idx, game_idx in self.team_games.get(team_idx, [])
+                ],
+            ),
+        )
+
+    def report_standings(self):
+        """Returns the league standings."""
+        self.load()
+        return self.reports.get(
+            "standings", (), lambda: self.schedule.standings.report(self.league)
+        )
 
 
 ################################################################################
@@ -462,7 +1038,26 @@ def main():
         --add_game 0 1 2 3 4 5 will produce 3 games in the week with Team 0
         playing at home against Team 1 playing away, and so on with pairings,
         2 vs 3, and 4 vs 5.  Example #2 --add_game 3 2 1 4 5 will produce three
-        games, 3 vs 2, 1 vs 4, and Team 5 gets a bye.""",
+        games, 3 vs 2, 1 vs 4, and Team 5 gets a bye.  --add_games swiss
+        pairs the next Swiss round from the standings instead, avoiding
+        rematches and giving any bye to a team that has not had one.""",
+    )
+    parser.add_argument(
+        "--generate",
+        choices=["round_robin"],
+        help="""Generates the games of a whole season for the current teams
+        and adds them to the schedule.""",
+    )
+    parser.add_argument(
+        "--double",
+        action="store_true",
+        help="With --generate round_robin, every pairing is played home and away.",
+    )
+    parser.add_argument(
+        "--start_week",
+        type=int,
+        help="""Week (counted from 1) the generated season starts in.  Defaults
+        to the week after the last one in the schedule.""",
     )
     parser.add_argument(
         "--result",
@@ -475,12 +1070,54 @@ def main():
     )
     parser.add_argument(
         "--report",
-        choices=["longteams", "shortteams", "schedule", "full", "current"],
-        help="Produces the selected report for the tournament.",
+        choices=[
+            "longteams",
+            "shortteams",
+            "schedule",
+            "full",
+            "current",
+            "standings",
+            "team",
+        ],
+        help="""Produces the selected report for the tournament.  The team
+        report needs --team.""",
+    )
+    parser.add_argument(
+        "--team",
+        help="Team name or index for the team report.",
+    )
+    parser.add_argument(
+        "--journal",
+        action="store_true",
+        help="""Records changes by appending them to a journal file next to the
+        tournament file instead of rewriting the whole file.""",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Folds the journal file into the tournament file.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["yaml", "sqlite"],
+        default="yaml",
+        help="""Storage of the tournament data.  With sqlite the filename is
+        the SQLite3 database file.""",
+    )
+    parser.add_argument(
+        "--name",
+        default="default",
+        help="Name of the tournament in the database (sqlite backend only).",
     )
     args = parser.parse_args()
 
-    tfile = TourneyFile(args.filename)
+    if args.backend == "sqlite":
+        # Imported here since bb_store builds on this module.
+        import bb_store
+
+        tfile = bb_store.TourneyStore(args.filename, args.name)
+    else:
+        tfile = TourneyFile(args.filename, journal=args.journal)
 
     if args.create:
         tfile.create()
@@ -496,8 +1133,13 @@ def main():
         tfile.decr_week()
     if args.add_games:
         tfile.add_games(args.add_games)
+    if args.generate == "round_robin":
+        tfile.generate_round_robin(args.double, args.start_week)
     if args.result:
         tfile.add_result(args.result)
+    if args.compact and args.backend == "yaml":
+        tfile.load()
+        tfile.compact()
     if args.report == "longteams" or args.report == "full":
         tfile.report_teams_long()
     if args.report == "shortteams":
@@ -506,6 +1148,15 @@ def main():
         print(tfile.report_full_schedule())
     if args.report == "current":
         print(tfile.report_current_week())
+    if args.report == "standings":
+        print(tfile.report_standings())
+    if args.report == "team":
+        if args.team is None:
+            parser.error("--report team requires --team")
+        try:
+            print(tfile.report_team(args.team))
+        except ValueError as e:
+            print(e)
 
 
 ################################################################################
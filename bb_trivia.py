@@ -1,40 +1,584 @@
 #! python3
 """This module implements methods required to open a YAML file of Blood Bowl
-trivia comments, and randomly select and print one."""
+trivia comments, and randomly select and print one.
+
+The YAML file is compiled into a binary store next to it the first time it is
+read (and again whenever the YAML file changes).  The store holds a header,
+a table of entry offsets and the UTF-8 (optionally zlib compressed) entries.
+It is memory mapped, so opening it parses nothing and selecting a bit of
+trivia only decodes the chosen entry.
+
+Selections for a channel go through a shuffle bag, so no bit of trivia is
+repeated in a channel before all of them have been shown.  Trivia can also be
+searched by keywords through an inverted index.
+
+Entries end with tags naming their source, such as [1st Ed.] or [WD104].
+Guilds can be given weights per tag (or tag family, 'wd' for every White
+Dwarf issue) and per topic word, which turn their selections into weighted
+picks from an alias table.  An example weights file:
+
+    default:
+      2nd ed.: 2
+    "662926998471835648":
+      1st ed.: 0.5
+      stars: 3
+      halfling: 2
+"""
 import argparse
+import bisect
+import json
+import math
+import mmap
+import os
 import random
+import re
+import struct
+import zlib
 import yaml
 
+STORE_SUFFIX = ".bin"
+STORE_MAGIC = b"BBTRIV01"
+# Magic, YAML modification time (ns), YAML size, number of entries, flags
+STORE_HEADER = struct.Struct("<8sqqII")
+STORE_OFFSET = struct.Struct("<I")
+STORE_COMPRESSED = 1
+
+TAG_RE = re.compile(r"\[([^\[\]]+)\]\s*$")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by did for from had has he his in is it its know "
+    "of on or that the their they this to was were which who with you".split()
+)
+
+
+################################################################################
+def build_store(store_name, entries, signature, compress=False):
+    """Writes the compiled store for a list of trivia strings.  signature is
+    the (modification time in ns, size) of the YAML file they came from.
+    The store is written to a temporary file first so readers never see a
+    partial one."""
+    blobs = [entry.encode("utf-8") for entry in entries]
+    if compress:
+        blobs = [zlib.compress(blob, 9) for blob in blobs]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    temp_name = store_name + ".tmp"
+    with open(temp_name, "wb") as f:
+        f.write(
+            STORE_HEADER.pack(
+                STORE_MAGIC,
+                signature[0],
+                signature[1],
+                len(blobs),
+                STORE_COMPRESSED if compress else 0,
+            )
+        )
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.writelines(blobs)
+    os.replace(temp_name, store_name)
+
+
+class TriviaStore:
+    """Read only sequence of the trivia strings of a compiled store.  Only
+    the header is read when opening, an entry is decoded when indexed."""
+
+    def __init__(self, store_name, signature=None):
+        """Raises ValueError if the file is not a store, or was not built
+        from a YAML file with the given signature."""
+        with open(store_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.map) < STORE_HEADER.size:
+                raise ValueError(f"{store_name} is not a trivia store")
+            magic, mtime_ns, size, self.count, flags = STORE_HEADER.unpack_from(
+                self.map
+            )
+            if magic != STORE_MAGIC:
+                raise ValueError(f"{store_name} is not a trivia store")
+            if signature is not None and (mtime_ns, size) != tuple(signature):
+                raise ValueError(f"{store_name} is out of date")
+        except ValueError:
+            self.map.close()
+            raise
+        self.compressed = flags & STORE_COMPRESSED
+        self.data_start = STORE_HEADER.size + STORE_OFFSET.size * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError("trivia index out of range")
+        position = STORE_HEADER.size + STORE_OFFSET.size * idx
+        (start,) = STORE_OFFSET.unpack_from(self.map, position)
+        (end,) = STORE_OFFSET.unpack_from(self.map, position + STORE_OFFSET.size)
+        blob = self.map[self.data_start + start : self.data_start + end]
+        if self.compressed:
+            blob = zlib.decompress(blob)
+        return blob.decode("utf-8")
+
+    def close(self):
+        """Unmaps the store."""
+        self.map.close()
+
+
+################################################################################
+def parse_tags(entry):
+    """Returns the tags at the end of an entry in lower case, for example
+    ['1st ed.'] for an entry ending with [1st Ed.]."""
+    tags = []
+    entry = entry.rstrip()
+    match = TAG_RE.search(entry)
+    while match:
+        tags.insert(0, match.group(1).strip().lower())
+        entry = entry[: match.start()].rstrip()
+        match = TAG_RE.search(entry)
+    return tags
+
+
+def tag_family(tag):
+    """Returns the family of a numbered tag, 'wd' for 'wd104'."""
+    return tag.rstrip("0123456789").strip()
+
+
+class AliasTable:
+    """Walker's alias method (in Vose's form) for drawing indexes with the
+    given weights.  Building is linear in the number of weights, a draw is
+    one random index and one coin flip."""
+
+    def __init__(self, weights):
+        num = len(weights)
+        total = float(sum(weights))
+        if num == 0 or total <= 0:
+            raise ValueError("At least one weight must be positive.")
+        scaled = [weight * num / total for weight in weights]
+        self.prob = [1.0] * num
+        self.alias = list(range(num))
+        small = [idx for idx, value in enumerate(scaled) if value < 1]
+        large = [idx for idx, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def draw(self):
+        """Returns a random index, following the weights."""
+        idx = random.randrange(len(self.prob))
+        if random.random() < self.prob[idx]:
+            return idx
+        return self.alias[idx]
+
+
+################################################################################
+def _mix(value, key, mask):
+    """Round function of the shuffle bag permutation, a keyed integer hash."""
+    value = ((value ^ key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value ^= value >> 29
+    value = (value * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    return (value ^ value >> 32) & mask
+
+
+class ShuffleBag:
+    """A shuffled order of range(size) which is never stored.  The order is
+    a pseudo random permutation given by the seed (a small Feistel network,
+    cycle walking to stay inside the range), so the whole state is the seed
+    and the position of the cursor.  Each draw costs a few integer hashes,
+    and a new seed is picked once every index has been drawn."""
+
+    ROUNDS = 4
+
+    def __init__(self, size, seed=None, position=0):
+        self.size = size
+        self.half = (max(2, (size - 1).bit_length()) + 1) // 2
+        self.mask = (1 << self.half) - 1
+        self.shuffle(seed)
+        self.position = position
+
+    def shuffle(self, seed=None):
+        """Starts a new permutation."""
+        self.seed = random.getrandbits(64) if seed is None else seed
+        rng = random.Random(self.seed)
+        self.keys = [rng.getrandbits(64) for _ in range(self.ROUNDS)]
+        self.position = 0
+
+    def permute(self, idx):
+        """Returns the index at position idx of the permutation.  The Feistel
+        network permutes a domain of up to four times the size, values
+        outside of the range are fed through again until one is inside."""
+        value = idx
+        while True:
+            left, right = value >> self.half, value & self.mask
+            for key in self.keys:
+                left, right = right, left ^ _mix(right, key, self.mask)
+            value = left << self.half | right
+            if value < self.size:
+                return value
+
+    def draw(self):
+        """Returns the next index of the permutation.  Raises IndexError when
+        the bag is empty, as random.choice does."""
+        if self.size == 0:
+            raise IndexError("Cannot draw from an empty shuffle bag.")
+        if self.position >= self.size:
+            self.shuffle()
+        idx = self.permute(self.position)
+        self.position += 1
+        return idx
+
+    @property
+    def state(self):
+        """The state to persist, see from_state."""
+        return {"size": self.size, "seed": self.seed, "position": self.position}
+
+    @classmethod
+    def from_state(cls, state, size):
+        """Restores a bag, starting a fresh one if the size has changed."""
+        if state is None or state["size"] != size:
+            return cls(size)
+        return cls(size, state["seed"], state["position"])
+
+
+################################################################################
+def stem(word):
+    """Strips the most common English suffixes so that, for example,
+    'halflings' and 'halfling' or 'played' and 'playing' match.  Plurals go
+    first, then -ing and -ed as long as a vowel is left."""
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+    for suffix in ("ing", "ed"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            base = word[: -len(suffix)]
+            if not set(base) & set("aeiouy"):
+                break
+            # running -> run, but not falling -> fal
+            if base[-1] == base[-2] and base[-1] not in "lsz":
+                base = base[:-1]
+            return base
+    return word
+
+
+def tokenize(text):
+    """Returns the stemmed words of a text, leaving out the stop words."""
+    return [
+        stem(word) for word in TOKEN_RE.findall(text.lower()) if word not in STOPWORDS
+    ]
+
+
+def _trigrams(word):
+    """Returns the set of three letter substrings of a word."""
+    return {word[idx : idx + 3] for idx in range(len(word) - 2)}
+
+
+class TriviaIndex:
+    """Inverted index over the trivia entries, ranking matches with BM25.
+    Query words that are not in the index are matched as partial words:
+    through a trigram index of the indexed words, or a prefix search of
+    the sorted words when shorter than three letters."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, entries):
+        # word -> {entry index: occurrences}
+        self.postings = {}
+        self.lengths = []
+        for idx, entry in enumerate(entries):
+            words = tokenize(entry)
+            self.lengths.append(len(words))
+            for word in words:
+                counts = self.postings.setdefault(word, {})
+                counts[idx] = counts.get(idx, 0) + 1
+        self.average = sum(self.lengths) / max(1, len(self.lengths))
+        self.words = sorted(self.postings)
+        self.trigrams = {}
+        for word in self.words:
+            for trigram in _trigrams(word):
+                self.trigrams.setdefault(trigram, set()).add(word)
+
+    def expand(self, word):
+        """Returns the indexed words a query word stands for: itself (once
+        stemmed) if indexed, otherwise every indexed word containing it."""
+        stemmed = stem(word)
+        if stemmed in self.postings:
+            return [stemmed]
+        if len(word) < 3:
+            start = bisect.bisect_left(self.words, word)
+            end = bisect.bisect_left(self.words, word + "\x7f")
+            return self.words[start:end]
+        candidates = None
+        for trigram in _trigrams(word):
+            words = self.trigrams.get(trigram, set())
+            candidates = words if candidates is None else candidates & words
+            if not candidates:
+                return []
+        return [candidate for candidate in candidates if word in candidate]
+
+    def _bm25(self, word):
+        """Returns {entry index: score} for a single indexed word."""
+        counts = self.postings[word]
+        num = len(self.lengths)
+        idf = math.log(1 + (num - len(counts) + 0.5) / (len(counts) + 0.5))
+        scores = {}
+        for idx, count in counts.items():
+            norm = 1 - self.B + self.B * self.lengths[idx] / self.average
+            scores[idx] = idf * count * (self.K1 + 1) / (count + self.K1 * norm)
+        return scores
+
+    def search(self, query):
+        """Returns (score, entry index) pairs for the entries matching any of
+        the query words, best first.  A partial word matching several indexed
+        words counts the best of them for each entry."""
+        totals = {}
+        for word in TOKEN_RE.findall(query.lower()):
+            if word in STOPWORDS:
+                continue
+            best = {}
+            for indexed in self.expand(word):
+                for idx, score in self._bm25(indexed).items():
+                    if score > best.get(idx, 0):
+                        best[idx] = score
+            for idx, score in best.items():
+                totals[idx] = totals.get(idx, 0) + score
+        return sorted(((score, idx) for idx, score in totals.items()), reverse=True)
+
 
 ################################################################################
 class TriviaFile:
     """Class encapsulates interactions with the trivia YAML file."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, compress=False, weights_file=None):
         self.filename = filename
+        self.store_name = filename + STORE_SUFFIX
+        self.compress = compress
         self.fileread = False
+        self.signature = None
         self.trivia = []
+        # Shuffle bag state of every channel, persisted next to the file.
+        self.bags_name = filename + ".bags.json"
+        self.bags = None
+        self.index = None
+        self.tags = None
+        # Per guild (or 'default') tag and topic weights, and the alias
+        # tables built from them.
+        self.weights_file = weights_file
+        self.weights_signature = None
+        self.weights = {}
+        self.alias_tables = {}
 
-    def read(self):
-        """Reads and populates the trivia list."""
+    def _signature(self):
+        """Modification time and size of the YAML file."""
+        stat = os.stat(self.filename)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def parse(self):
+        """Reads the trivia list from the YAML file."""
         with open(self.filename, "r") as f:
             blob = yaml.safe_load(f)
-        self.trivia = blob["trivia"]
+        return blob["trivia"]
+
+    def build(self):
+        """Compiles the YAML file into the store."""
+        self.signature = self._signature()
+        build_store(self.store_name, self.parse(), self.signature, self.compress)
+
+    def read(self):
+        """Opens the trivia store, building it first if it is missing or does
+        not match the YAML file.  When the store cannot be written the parsed
+        list is used instead."""
+        self.close()
+        self.signature = self._signature()
+        try:
+            self.trivia = TriviaStore(self.store_name, self.signature)
+        except (OSError, ValueError):
+            entries = self.parse()
+            try:
+                build_store(self.store_name, entries, self.signature, self.compress)
+                self.trivia = TriviaStore(self.store_name, self.signature)
+            except OSError:
+                self.trivia = entries
+        # Built on first use, since building decodes every entry.
+        self.index = None
+        self.tags = None
+        self.alias_tables = {}
         self.fileread = True
 
+    def close(self):
+        """Releases the store, if one is open."""
+        if isinstance(self.trivia, TriviaStore):
+            self.trivia.close()
+        self.trivia = []
+        self.fileread = False
+
+    def _check(self):
+        """Reads the file if it has not been read or has changed since."""
+        if not self.fileread or self._signature() != self.signature:
+            self.read()
+
     @property
     def select(self):
         """Returning a string assignment version (since __str__ is meant to be
         used with print and other methods.)"""
-        if not self.fileread:
-            self.read()
+        self._check()
         return random.choice(self.trivia)
 
+    def _search_index(self):
+        """Returns the search index, building it the first time."""
+        if self.index is None:
+            self.index = TriviaIndex(list(self.trivia))
+        return self.index
+
+    def _entry_tags(self):
+        """Returns the tags of every entry, parsing them the first time."""
+        if self.tags is None:
+            self.tags = [parse_tags(entry) for entry in self.trivia]
+        return self.tags
+
+    def search(self, keywords):
+        """Returns a bit of trivia matching the keywords (None if nothing
+        does).  The better an entry matches, the more likely it is to be the
+        one returned."""
+        self._check()
+        matches = self._search_index().search(keywords)
+        if not matches:
+            return None
+        scores, indexes = zip(*matches)
+        return self.trivia[random.choices(indexes, weights=scores)[0]]
+
+    def _check_weights(self):
+        """Loads the weights file if it has changed since it was read.  A
+        missing weights file means no weights."""
+        if self.weights_file is None:
+            return
+        try:
+            stat = os.stat(self.weights_file)
+        except OSError:
+            self.weights = {}
+            self.alias_tables = {}
+            self.weights_signature = None
+            return
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self.weights_signature:
+            return
+        with open(self.weights_file, "r") as f:
+            blob = yaml.safe_load(f) or {}
+        self.weights = {}
+        for guild, weights in blob.items():
+            try:
+                self.set_weights(guild, weights)
+            except ValueError:
+                # A guild with bad weights keeps its plain shuffle bag.
+                continue
+        self.weights_signature = signature
+
+    def set_weights(self, guild, weights):
+        """Sets the weights of a guild ('default' for every guild without
+        weights of its own).  Keys are tags, tag families or topic words, and
+        entries get the product of the weights that apply to them (1 when
+        none do, 'untagged' applying to entries without tags).  Raises
+        ValueError unless every weight is a finite number of 0 or more."""
+        if not isinstance(weights, dict):
+            raise ValueError(f"The weights of {guild} are not a dictionary.")
+        checked = {}
+        for key, value in weights.items():
+            try:
+                weight = float(value)
+            except (TypeError, ValueError):
+                weight = math.nan
+            if not math.isfinite(weight) or weight < 0:
+                raise ValueError(f"Invalid weight {value!r} for {key} in {guild}.")
+            checked[str(key).strip().lower()] = weight
+        guild = str(guild)
+        self.weights[guild] = checked
+        self.alias_tables.pop(guild, None)
+
+    def entry_weights(self, weights):
+        """Returns the weight of every entry for a dictionary of weights."""
+        entry_tags = self._entry_tags()
+        known = {"untagged"}
+        for tags in entry_tags:
+            known.update(tags)
+            known.update(tag_family(tag) for tag in tags)
+        topics = {}
+        for key, weight in weights.items():
+            if key not in known:
+                for _, idx in self._search_index().search(key):
+                    topics[idx] = topics.get(idx, 1.0) * weight
+        result = []
+        for idx, tags in enumerate(entry_tags):
+            weight = topics.get(idx, 1.0)
+            if not tags:
+                weight *= weights.get("untagged", 1.0)
+            for tag in tags:
+                weight *= weights.get(tag, weights.get(tag_family(tag), 1.0))
+            result.append(weight)
+        return result
+
+    def select_weighted(self, guild):
+        """Returns a bit of trivia picked with the weights of a guild, or None
+        if no weights apply to it or they weigh every entry 0.  The alias
+        table of a guild is only built again when its weights or the trivia
+        file have changed."""
+        self._check()
+        self._check_weights()
+        guild = str(guild)
+        if guild not in self.weights:
+            guild = "default"
+            if guild not in self.weights:
+                return None
+        if guild not in self.alias_tables:
+            try:
+                self.alias_tables[guild] = AliasTable(
+                    self.entry_weights(self.weights[guild])
+                )
+            except ValueError:
+                self.alias_tables[guild] = None
+        if self.alias_tables[guild] is None:
+            return None
+        return self.trivia[self.alias_tables[guild].draw()]
+
+    def select_for(self, channel, guild=None):
+        """Returns the next bit of trivia from the shuffle bag of a channel,
+        so nothing repeats in the channel until every bit has been shown.
+        The bag states are saved after every draw.  When the guild has
+        weights the pick is weighted instead."""
+        if guild is not None:
+            tidbit = self.select_weighted(guild)
+            if tidbit is not None:
+                return tidbit
+        self._check()
+        if self.bags is None:
+            try:
+                with open(self.bags_name, "r") as f:
+                    self.bags = json.load(f)
+            except (OSError, ValueError):
+                self.bags = {}
+        channel = str(channel)
+        bag = ShuffleBag.from_state(self.bags.get(channel), len(self.trivia))
+        tidbit = self.trivia[bag.draw()]
+        self.bags[channel] = bag.state
+        try:
+            with open(self.bags_name + ".tmp", "w") as f:
+                json.dump(self.bags, f)
+            os.replace(self.bags_name + ".tmp", self.bags_name)
+        except OSError:
+            # The bags still work in memory, they just won't survive a restart.
+            pass
+        return tidbit
+
     def __str__(self):
         """Given a list of trivia facts, select one randomly and returns it so
         it may be printed."""
-        if not self.fileread:
-            self.read()
+        self._check()
         return random.choice(self.trivia)
 
 
@@ -45,10 +589,50 @@ def main():
         prog="bb_trivia", description="Prints out a random Blood Bowl trivia fact."
     )
     parser.add_argument("filename", help="The trivia data file (YAML format).")
+    parser.add_argument(
+        "--build",
+        action="store_true",
+        help="""Compiles the trivia file into its binary store (normally done
+        automatically when the trivia file changes) instead of printing.""",
+    )
+    parser.add_argument(
+        "--search",
+        help="Prints a bit of trivia matching the keywords instead.",
+    )
+    parser.add_argument(
+        "--channel",
+        help="""Draws from the shuffle bag of the named channel, which does not
+        repeat a bit of trivia until all of them have been shown.""",
+    )
+    parser.add_argument(
+        "--weights",
+        help="""Weights file (see the module documentation) to pick the trivia
+        with, using the 'default' weights or those of --guild.""",
+    )
+    parser.add_argument(
+        "--guild",
+        default="default",
+        help="Guild whose weights are used with --weights.",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compresses the entries of the binary store.",
+    )
     args = parser.parse_args()
 
-    tfile = TriviaFile(args.filename)
-    print(tfile)
+    tfile = TriviaFile(args.filename, args.compress, args.weights)
+    if args.build:
+        tfile.build()
+        print(f"Built {tfile.store_name}")
+    elif args.search:
+        print(tfile.search(args.search) or f"No trivia found about {args.search}")
+    elif args.channel:
+        print(tfile.select_for(args.channel, args.guild if args.weights else None))
+    elif args.weights:
+        print(tfile.select_weighted(args.guild) or tfile.select)
+    else:
+        print(tfile)
 
 
 ################################################################################
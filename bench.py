@@ -0,0 +1,353 @@
+#! python3
+"""This module implements the benchmark suite of the hot paths: dice rolling
+and pattern compiling, reading, writing, recording results in and reporting
+on tournament files, and drawing trivia.  Tournaments and trivia are
+synthetic, generated from a fixed seed in a temporary directory, so runs on
+the same machine are comparable.  The results are printed and written as
+JSON, and --compare prints the ratio of every timing to an earlier run.
+
+    python bench.py
+    python bench.py --quick --output new.json --compare bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import bb_pairing
+import bb_tournament
+import bb_trivia
+import xdice
+
+GROUPS = ("dice", "tourney", "trivia")
+DICE_CASES = {
+    "simple": ["1d20", "3d6+4"],
+    "drop/keep": ["4d6l", "2d20h", "5d10l1h1"],
+    "exploding": ["3d6x", "1d10!+2"],
+    "repeat": ["r6(4d6l)", "r3(1d20+5)"],
+}
+LEAGUE_SIZES = (16, 128, 512, 2000)
+TRIVIA_SIZES = (123, 5000)
+WORDS = (
+    "ball blitz block dodge foul ogre troll orc elf dwarf halfling skaven "
+    "goblin human lizardman undead chaos norse amazon vampire referee crowd "
+    "touchdown casualty apothecary wizard bribe pitch stadium league cup"
+).split()
+TAGS = ("1st Ed.", "2nd Ed.", "3rd Ed.", "LRB6", "WD104", "Spike 7")
+
+
+################################################################################
+class Bench:
+    """Class runs the timings and collects their results."""
+
+    def __init__(self, repeat=5, min_time=0.2, seed=2020):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.seed = seed
+        self.results = []
+
+    def measure(self, group, name, func, setup=None, **params):
+        """Times func and records the seconds per call.  Without setup the
+        number of calls per run is calibrated like timeit does, with it
+        every run is a single call made right after setup(), which is not
+        timed.  The random generator is reseeded before every case."""
+        random.seed(self.seed)
+        if setup is None:
+            timer = timeit.Timer(func)
+            number, elapsed = timer.autorange()
+            while elapsed < self.min_time:
+                number *= 2
+                elapsed = timer.timeit(number)
+            times = [run / number for run in timer.repeat(self.repeat, number)]
+        else:
+            number = 1
+            times = []
+            for _ in range(self.repeat):
+                setup()
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+        result = {
+            "group": group,
+            "name": name,
+            "params": params,
+            "number": number,
+            "repeat": self.repeat,
+            "best": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        }
+        self.results.append(result)
+        print(f"{label(result):60} {format_time(result['best']):>10}", flush=True)
+        return result
+
+    def report(self):
+        """Returns the run as the dictionary written to the JSON file."""
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version,
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "seed": self.seed,
+            "repeat": self.repeat,
+            "results": self.results,
+        }
+
+
+################################################################################
+def label(result):
+    """Returns the line identifying a result, also used to match the results
+    of two runs."""
+    params = " ".join(f"{key}={value}" for key, value in result["params"].items())
+    return f"{result['group']}.{result['name']} {params}".strip()
+
+
+def format_time(seconds):
+    """Returns a duration with a readable unit."""
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+################################################################################
+def bench_dice(bench):
+    """Times rolling through the pattern cache, and compiling a pattern."""
+    for kind, expressions in DICE_CASES.items():
+        for expr in expressions:
+            bench.measure(
+                "dice", "roll", lambda: xdice.roll(expr), kind=kind, expr=expr
+            )
+            bench.measure(
+                "dice",
+                "compile",
+                lambda: xdice.Pattern(expr).compile(),
+                kind=kind,
+                expr=expr,
+            )
+
+
+################################################################################
+def make_league(filename, num_teams, weeks, played):
+    """Writes a tournament of num_teams teams playing the first weeks rounds
+    of a round robin, with random results in the first played weeks and the
+    week after them as the current week."""
+    tourney = bb_tournament.TourneyFile(filename)
+    for team_idx in range(num_teams):
+        tourney._add_team(
+            f"Team {team_idx}, Race {team_idx % 24}, Coach {team_idx}, tag{team_idx}"
+        )
+    rounds = bb_pairing.round_robin(num_teams)[:weeks]
+    tourney._add_schedule(rounds, 0)
+    for week_idx in range(played):
+        for game_idx in range(len(tourney.schedule[week_idx])):
+            tourney._add_result(
+                [game_idx, random.randint(0, 4), random.randint(0, 4)], week_idx
+            )
+    tourney.current_week = min(played, len(tourney.schedule) - 1)
+    tourney.write(tourney.make_blob)
+    return tourney.make_blob
+
+
+def bench_tourney(bench, directory, sizes, weeks):
+    """Times the tournament file operations on leagues of every size.
+    add_result is timed as the command line runs it (a full read and
+    write) and as the bot runs it (resident, appending to the journal)."""
+    for num_teams in sizes:
+        filename = os.path.join(directory, f"league_{num_teams}.yaml")
+        random.seed(bench.seed)
+        blob = make_league(filename, num_teams, weeks, weeks // 2)
+        games = sum(len(week) for week in blob["schedule"].values())
+        params = {"teams": num_teams, "games": games}
+
+        tourney = bb_tournament.TourneyFile(filename)
+        bench.measure("tourney", "write", lambda: tourney.write(blob), **params)
+        bench.measure("tourney", "read", tourney.read, **params)
+
+        result = ["0", "3", "1"]
+        bench.measure(
+            "tourney",
+            "add_result",
+            lambda: bb_tournament.TourneyFile(filename).add_result(result),
+            mode="file",
+            **params,
+        )
+        resident = bb_tournament.TourneyFile(filename, resident=True, journal=True)
+        # Compaction would add a snapshot write to some of the calls.
+        resident.compact_size = float("inf")
+        resident.load()
+        bench.measure(
+            "tourney",
+            "add_result",
+            lambda: resident.add_result(result),
+            mode="journal",
+            **params,
+        )
+        resident.compact()
+
+        bench.measure(
+            "tourney",
+            "report_current_week",
+            resident.report_current_week,
+            setup=resident.reports.bump,
+            cache="cold",
+            **params,
+        )
+        bench.measure(
+            "tourney",
+            "report_current_week",
+            resident.report_current_week,
+            cache="warm",
+            **params,
+        )
+
+
+################################################################################
+def make_trivia(filename, num_entries):
+    """Writes a trivia file of num_entries random entries, each with one or
+    two tags."""
+    entries = []
+    for _ in range(num_entries):
+        sentence = " ".join(random.choices(WORDS, k=random.randint(20, 80)))
+        tags = " ".join(f"[{tag}]" for tag in random.sample(TAGS, random.randint(1, 2)))
+        entries.append(f"__***Did you know***__ that {sentence}? {tags}")
+    with open(filename, "w") as f:
+        bb_tournament.yaml.dump(
+            {"trivia": entries}, f, Dumper=bb_tournament.YAML_DUMPER
+        )
+
+
+def bench_trivia(bench, directory, sizes):
+    """Times TriviaFile.select: cold (the store is built from the YAML
+    file), open (the store is on disk but the file object is new) and warm
+    (the file object has already been used)."""
+    for num_entries in sizes:
+        filename = os.path.join(directory, f"trivia_{num_entries}.yaml")
+        random.seed(bench.seed)
+        make_trivia(filename, num_entries)
+        store_name = filename + bb_trivia.STORE_SUFFIX
+
+        def remove_store():
+            if os.path.exists(store_name):
+                os.remove(store_name)
+
+        opened = []
+
+        def select():
+            trivia = bb_trivia.TriviaFile(filename)
+            opened.append(trivia)
+            return trivia.select
+
+        bench.measure(
+            "trivia",
+            "select",
+            select,
+            setup=remove_store,
+            cache="cold",
+            entries=num_entries,
+        )
+        bench.measure(
+            "trivia",
+            "select",
+            select,
+            setup=lambda: None,
+            cache="open",
+            entries=num_entries,
+        )
+        trivia = bb_trivia.TriviaFile(filename)
+        trivia.select
+        bench.measure(
+            "trivia", "select", lambda: trivia.select, cache="warm", entries=num_entries
+        )
+        for trivia_file in opened + [trivia]:
+            trivia_file.close()
+
+
+################################################################################
+def compare(results, old_filename):
+    """Prints the ratio of the best times of this run to those of an
+    earlier one, for the cases found in both."""
+    with open(old_filename, "r") as f:
+        old = {label(result): result for result in json.load(f)["results"]}
+    print(f"\nCompared to {old_filename} (new / old best time):")
+    for result in results:
+        previous = old.get(label(result))
+        if previous is None or not previous["best"]:
+            continue
+        ratio = result["best"] / previous["best"]
+        print(
+            f"{label(result):60} {format_time(previous['best']):>10} "
+            f"-> {format_time(result['best']):>10}  x{ratio:.2f}"
+        )
+
+
+################################################################################
+def main():
+    """Main function to run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths.")
+    parser.add_argument(
+        "--groups",
+        nargs="+",
+        choices=GROUPS,
+        default=list(GROUPS),
+        help="Benchmarks to run",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=list(LEAGUE_SIZES),
+        help="League sizes, in teams",
+    )
+    parser.add_argument(
+        "--weeks", type=int, default=8, help="Weeks of round robin in each league"
+    )
+    parser.add_argument(
+        "--trivia_sizes",
+        nargs="+",
+        type=int,
+        default=list(TRIVIA_SIZES),
+        help="Trivia file sizes, in entries",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--seed", type=int, default=2020, help="Random seed")
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Fewer runs and only the small leagues, for a quick check",
+    )
+    parser.add_argument(
+        "--output", default="bench_results.json", help="JSON file for the results"
+    )
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare to")
+    args = parser.parse_args()
+
+    bench = Bench(args.repeat, seed=args.seed)
+    sizes = args.sizes
+    if args.quick:
+        bench.repeat = 3
+        bench.min_time = 0.05
+        sizes = [size for size in sizes if size <= 128]
+    if "dice" in args.groups:
+        bench_dice(bench)
+    with tempfile.TemporaryDirectory() as directory:
+        if "tourney" in args.groups:
+            bench_tourney(bench, directory, sizes, args.weeks)
+        if "trivia" in args.groups:
+            bench_trivia(bench, directory, args.trivia_sizes)
+    with open(args.output, "w") as f:
+        json.dump(bench.report(), f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #! python3
 """
-    usage: roll [-h] [-V] [-n] [-v] expression [expression ...]
+    usage: roll [-h] [-V] [-n] [-v] [-o] [-s N] [-w WORKERS] [--seed SEED]
+                expression [expression ...]
     
     Command Line Interface for the xdice library
     
@@ -12,10 +13,100 @@
       -V, --version   print the xdice version string and exit
       -n, --num_only  print numeric result only
       -v, --verbose   print a verbose result
+      -o, --odds      print the exact odds of every result instead of rolling
+      -s N, --simulate N
+                      roll each expression N times (split across processes)
+                      and print summary statistics instead of rolling once
+      -w WORKERS, --workers WORKERS
+                      number of processes used by --simulate (default: one per
+                      cpu)
+      --seed SEED     seed of the --simulate random streams, for reproducible
+                      runs (default: random)
 """
 import argparse
+import collections
+import concurrent.futures
+import os
+import random
 import xdice
 
+try:
+    import numpy
+except ImportError:  # numpy is only required by --simulate
+    numpy = None
+
+# number of rolls made at once by a simulation worker
+SIMULATE_BATCH = 1 << 18
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+def _simulate_chunk(expr, n, seed_seq):
+    """ Worker process: roll expr n times and return the histogram of the
+    results as a dictionary {result: count} """
+    pattern = xdice.cached_compile(expr)
+    rng = numpy.random.default_rng(seed_seq)
+    histogram = collections.Counter()
+    while n > 0:
+        results = pattern.roll_many(min(n, SIMULATE_BATCH), rng=rng)
+        lowest = int(results.min())
+        counts = numpy.bincount(results - lowest)
+        for offset in counts.nonzero()[0]:
+            histogram[lowest + int(offset)] += int(counts[offset])
+        n -= len(results)
+    return histogram
+
+
+def simulate(expr, n, workers=None, seed=None):
+    """ Roll expr n times, split across worker processes each using an
+    independent random stream spawned from seed, and return the merged
+    histogram {result: count}.  For a given seed and number of workers the
+    histogram is always the same. """
+    if numpy is None:
+        raise ImportError("numpy is required by --simulate")
+    workers = workers or os.cpu_count() or 1
+    xdice.compile(expr)  # report invalid expressions before starting processes
+    streams = numpy.random.SeedSequence(seed).spawn(workers)
+    chunks = [n // workers + (1 if idx < n % workers else 0) for idx in range(workers)]
+
+    histogram = collections.Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(_simulate_chunk, [expr] * workers, chunks, streams):
+            histogram.update(partial)
+    return histogram
+
+
+def format_summary(histogram):
+    """ Return the summary statistics and percentiles of a histogram """
+    n = sum(histogram.values())
+    mean = sum(value * count for value, count in histogram.items()) / n
+    variance = sum((value - mean) ** 2 * count for value, count in histogram.items()) / n
+    lines = ["rolls: {}  mean: {:.4f}  std: {:.4f}  min: {}  max: {}".format(
+        n, mean, variance ** 0.5, min(histogram), max(histogram))]
+
+    percentiles = []
+    targets = iter(PERCENTILES)
+    target = next(targets)
+    cumulated = 0
+    for value in sorted(histogram):
+        cumulated += histogram[value]
+        while target is not None and cumulated * 100 >= target * n:
+            percentiles.append("p{}: {}".format(target, value))
+            target = next(targets, None)
+    lines.append("  ".join(percentiles))
+    return "\n".join(lines)
+
+def positive_int(value):
+    """ argparse type of --simulate and --workers: an integer of 1 or more,
+    which may be written like 1e6 """
+    try:
+        number = int(float(value))
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError("invalid number: '{}'".format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be 1 or more: '{}'".format(value))
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="roll", description="Command Line Interface for the xdice library"
@@ -43,13 +134,63 @@ def main():
         action="store_true",
         help="print a verbose result",
     )
+    parser.add_argument(
+        "-o",
+        "--odds",
+        action="store_true",
+        help="print the exact odds of every result instead of rolling",
+    )
+    parser.add_argument(
+        "-s",
+        "--simulate",
+        metavar="N",
+        type=positive_int,
+        help="""roll each expression N times (split across processes) and print
+        summary statistics instead of rolling once""",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=positive_int,
+        help="number of processes used by --simulate (default: one per cpu)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed of the --simulate random streams, for reproducible runs (default: random)",
+    )
     args = parser.parse_args()
 
     if args.version:
         print("XDice {}".format(xdice.__VERSION__))
         return
     
+    if args.simulate and args.seed is None:
+        args.seed = random.getrandbits(64)
+        print("seed: {}".format(args.seed))
+
     for expr in args.expression:
+        if args.simulate:
+            try:
+                histogram = simulate(expr, args.simulate, args.workers, args.seed)
+            except (ValueError, ZeroDivisionError) as e:
+                # an invalid pattern, or an error in some of the rolls
+                print("{}\n{}".format(expr, e))
+                continue
+            print("{}\n{}".format(expr, format_summary(histogram)))
+            continue
+
+        if args.odds:
+            try:
+                distribution = xdice.cached_compile(expr).distribution()
+            except (ValueError, ZeroDivisionError) as e:
+                # too much work, a pattern the exact computation does not support,
+                # or a division by zero in some outcome
+                print("{}\n{}".format(expr, e))
+                continue
+            print("{}\n{}".format(expr, distribution.format()))
+            continue
+
         ps = xdice.roll(expr)
         
         if args.num_only:
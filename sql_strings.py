@@ -123,12 +123,120 @@ create_games_table = """CREATE TABLE IF NOT EXISTS games (
     tourney_id    INTEGER NOT NULL,
     round_num     INTEGER NOT NULL,
     home_id       INTEGER NOT NULL,
-    visitor_id    INTEGER NOT NULL,
+    visitor_id    INTEGER,
     gamestate_id  INTEGER NOT NULL,
     home_score    INTEGER,
     visitor_score INTEGER,
     FOREIGN KEY (tourney_id)   REFERENCES tournaments (id),
     FOREIGN KEY (home_id)      REFERENCES tournament_teams (id),
     FOREIGN KEY (visitor_id)   REFERENCES tournament_teams (id),
-    FOREIGN KEY (gamestate_id) REFERENCES gamestate (id)
+    FOREIGN KEY (gamestate_id) REFERENCES gamestates (id)
 );"""
+# A bye game has no visitor (NULL visitor_id).
+
+# Indexes for the tournament queries: games of a round, games of a team and
+# the teams of a tournament.
+create_indexes = [
+    "CREATE INDEX IF NOT EXISTS games_round_idx ON games (tourney_id, round_num);",
+    "CREATE INDEX IF NOT EXISTS games_home_idx ON games (home_id);",
+    "CREATE INDEX IF NOT EXISTS games_visitor_idx ON games (visitor_id);",
+    "CREATE INDEX IF NOT EXISTS tournament_teams_idx ON tournament_teams (tourney_id);",
+]
+
+################################################################################
+# Tournament backend (bb_store) commands
+################################################################################
+count_gamestates_cmd = """SELECT COUNT(*) FROM gamestates"""
+select_race_cmd = """SELECT id FROM races WHERE race = ? AND bb_ver = ?"""
+select_coach_cmd = (
+    """SELECT id FROM coaches WHERE bb2_name = ? AND discord_name = ?"""
+)
+insert_team_cmd = (
+    """INSERT INTO teams (name, bb_ver, race_id, coach_id) VALUES (?, ?, ?, ?)"""
+)
+
+select_tournament_cmd = """SELECT id, num_rounds, current_round FROM tournaments
+    WHERE name = ?"""
+insert_tournament_cmd = """INSERT INTO tournaments
+    (name, bb_ver, tourneystate_id, num_teams, num_rounds, current_round)
+    VALUES (?, ?, 1, 0, 0, 0)"""
+update_num_teams_cmd = """UPDATE tournaments SET num_teams = num_teams + ? WHERE id = ?"""
+update_num_rounds_cmd = """UPDATE tournaments SET num_rounds = num_rounds + 1 WHERE id = ?"""
+extend_num_rounds_cmd = """UPDATE tournaments SET num_rounds = MAX(num_rounds, ?) WHERE id = ?"""
+update_current_round_cmd = """UPDATE tournaments SET current_round = ? WHERE id = ?"""
+
+insert_tournament_team_cmd = (
+    """INSERT INTO tournament_teams (bb_ver, tourney_id, team_id) VALUES (?, ?, ?)"""
+)
+delete_tournament_team_cmd = """DELETE FROM tournament_teams WHERE id = ?"""
+# Teams of a tournament, in the order they were added (their index).
+select_tournament_teams_cmd = """SELECT tt.id, t.name, r.race, c.bb2_name, c.discord_name
+    FROM tournament_teams tt
+    JOIN teams t ON t.id = tt.team_id
+    JOIN races r ON r.id = t.race_id
+    JOIN coaches c ON c.id = t.coach_id
+    WHERE tt.tourney_id = ?
+    ORDER BY tt.id"""
+count_team_games_cmd = """SELECT
+    (SELECT COUNT(*) FROM games WHERE home_id = ?) +
+    (SELECT COUNT(*) FROM games WHERE visitor_id = ?)"""
+
+insert_game_cmd = """INSERT INTO games
+    (bb_ver, tourney_id, round_num, home_id, visitor_id, gamestate_id)
+    VALUES (?, ?, ?, ?, ?, 1)"""
+# The n-th game of a round (game numbers are in insertion order).
+select_round_game_cmd = """SELECT id FROM games
+    WHERE tourney_id = ? AND round_num = ?
+    ORDER BY id LIMIT 1 OFFSET ?"""
+update_game_result_cmd = """UPDATE games
+    SET home_score = ?, visitor_score = ?, gamestate_id = ? WHERE id = ?"""
+select_round_games_cmd = """SELECT round_num, home_id, visitor_id, home_score, visitor_score
+    FROM games WHERE tourney_id = ? AND round_num = ? ORDER BY id"""
+select_all_games_cmd = """SELECT round_num, home_id, visitor_id, home_score, visitor_score
+    FROM games WHERE tourney_id = ? ORDER BY round_num, id"""
+# Every game of one team with its game number in the round.
+# The games of a team come from the home and visitor indexes (a team id is
+# only in one tournament), and the number of a game in its round from the
+# round index, so no other game row is read.
+select_team_games_cmd = """SELECT round_num,
+    (SELECT COUNT(*) FROM games AS earlier
+        WHERE earlier.tourney_id = team_games.tourney_id
+        AND earlier.round_num = team_games.round_num
+        AND earlier.id < team_games.id) AS game_num,
+    home_id, visitor_id, home_score, visitor_score FROM (
+        SELECT id, tourney_id, round_num, home_id, visitor_id, home_score,
+            visitor_score FROM games WHERE home_id = ?
+        UNION ALL
+        SELECT id, tourney_id, round_num, home_id, visitor_id, home_score,
+            visitor_score FROM games WHERE visitor_id = ?
+    ) AS team_games
+    ORDER BY round_num, game_num"""
+
+################################################################################
+# Migration (bb_db --migrate) commands
+################################################################################
+select_races_cmd = """SELECT race, id FROM races WHERE bb_ver = ?"""
+select_coaches_cmd = """SELECT bb2_name, discord_name, id FROM coaches"""
+select_max_id_cmd = "SELECT COALESCE(MAX(id), 0) FROM {}"
+select_ids_after_cmd = "SELECT id FROM {} WHERE id > ? ORDER BY id"
+insert_migrated_tournament_cmd = """INSERT INTO tournaments
+    (name, bb_ver, tourneystate_id, num_teams, num_rounds, current_round)
+    VALUES (?, ?, 2, ?, ?, ?)"""
+insert_migrated_game_cmd = """INSERT INTO games
+    (bb_ver, tourney_id, round_num, home_id, visitor_id, gamestate_id,
+    home_score, visitor_score)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+count_tournament_teams_cmd = """SELECT COUNT(*) FROM tournament_teams WHERE tourney_id = ?"""
+count_tournament_games_cmd = """SELECT COUNT(*) FROM games WHERE tourney_id = ?"""
+# Settings of the ConnectionManager connections.  WAL lets readers proceed
+# while a write is in progress, and is persistent so it is set by the writer.
+wal_pragma = "PRAGMA journal_mode = WAL"
+connection_pragmas = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -{cache_kib}",
+]
+
+# Relaxed durability for bulk loads, and the default setting to restore.
+bulk_load_pragmas = ["PRAGMA synchronous = OFF", "PRAGMA cache_size = -65536"]
+restore_pragmas = ["PRAGMA synchronous = FULL", "PRAGMA cache_size = -2000"]
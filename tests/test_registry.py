@@ -0,0 +1,61 @@
+"""Tests of the tournament registry."""
+import asyncio
+import bb_async
+import bb_registry
+
+
+class FakeStore:
+    """Stands in for a tournament, counting the calls to close()."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.closed = 0
+
+    def report_current_week(self):
+        return "week"
+
+    def close(self):
+        self.closed += 1
+
+
+def make_registry(tmp_path, **kwargs):
+    routes = tmp_path / "routes.yaml"
+    routes.write_text("'1':\n  file: one.yaml\n'2':\n  file: two.yaml\n")
+    registry = bb_registry.TourneyRegistry(str(routes), **kwargs)
+    registry._open = lambda key: bb_async.AsyncTourneyFile(
+        FakeStore(key[1]), registry.executor
+    )
+    return registry
+
+
+def test_close_on_lru_eviction(tmp_path):
+    registry = make_registry(tmp_path, capacity=1)
+    first = registry.get(1)
+    registry.get(2)
+    assert first.wrapped.closed == 1
+    assert registry.get(2).wrapped.closed == 0
+
+
+def test_close_on_idle_eviction(tmp_path):
+    registry = make_registry(tmp_path, idle_seconds=10)
+    first = registry.get(1)
+    registry.evict_idle(registry.cache[("yaml", "one.yaml", "default")][1] + 11)
+    assert first.wrapped.closed == 1
+    assert not registry.cache
+
+
+def test_close_waits_for_calls_in_progress(tmp_path):
+    registry = make_registry(tmp_path, capacity=1)
+
+    async def evict_during_call():
+        first = registry.get(1)
+        call = asyncio.ensure_future(first.report_current_week())
+        await asyncio.sleep(0)
+        registry.get(2)
+        closed_during_call = first.wrapped.closed
+        assert await call == "week"
+        return first, closed_during_call
+
+    first, closed_during_call = asyncio.run(evict_during_call())
+    assert closed_during_call == 0
+    assert first.wrapped.closed == 1
@@ -0,0 +1,48 @@
+"""Tests of the tournament file and store."""
+import bb_store
+import bb_tournament
+
+
+def make_tourney(tmp_path):
+    """Returns a journaled tournament of four teams with one week of games."""
+    tourney = bb_tournament.TourneyFile(str(tmp_path / "t.yaml"), journal=True)
+    tourney.create()
+    for idx in range(4):
+        tourney.add_team(f"Team {idx}, Orc, Coach {idx}, tag{idx}")
+    tourney.add_week()
+    tourney.add_games(["0", "1", "2", "3"])
+    return tourney
+
+
+def test_append_after_torn_journal_line(tmp_path):
+    tourney = make_tourney(tmp_path)
+    tourney.add_result(["0", "2", "1"])
+    # A crash in the middle of an append leaves half a line behind.
+    with open(tourney.journal_name, "a") as f:
+        f.write('{"seq": 99, "op": "add_res')
+    tourney = bb_tournament.TourneyFile(tourney.filename, journal=True)
+    tourney.add_result(["1", "3", "0"])
+
+    reloaded = bb_tournament.TourneyFile(tourney.filename)
+    reloaded.read()
+    assert reloaded.schedule[0][0].result == {"home": 2, "away": 1}
+    assert reloaded.schedule[0][1].result == {"home": 3, "away": 0}
+    reloaded.compact()
+    reloaded.read()
+    assert reloaded.schedule[0][1].result == {"home": 3, "away": 0}
+
+
+def test_team_report_does_not_count_byes(tmp_path):
+    tourneys = [
+        bb_tournament.TourneyFile(str(tmp_path / "t.yaml")),
+        bb_store.TourneyStore(str(tmp_path / "t.db")),
+    ]
+    for tourney in tourneys:
+        tourney.create()
+        for idx in range(5):
+            tourney.add_team(f"T{idx}, Orc, Coach {idx}, tag{idx}")
+        tourney.generate_round_robin(double=True)
+        report = tourney.report_team("T2")
+        assert report.splitlines()[0] == "Games for T2: 8 (byes: 2)"
+        assert len(report.splitlines()) == 11
+    tourneys[1].close()
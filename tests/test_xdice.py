@@ -0,0 +1,13 @@
+"""Tests of the dice patterns."""
+import xdice
+
+
+def test_long_repeat():
+    score = xdice.roll("r1200(1d6)")
+    assert 1200 <= score <= 7200
+    assert len(score.scores()) == 1200
+
+
+def test_operator_chain_order():
+    pattern = xdice.compile("10-1d4*2+1d6//2-1")
+    assert pattern.expression([3, 5]) == 10 - 3 * 2 + 5 // 2 - 1
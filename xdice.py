@@ -5,11 +5,31 @@
 
 @author: Olivier Massot <croki.contact@gmail.com>, 2017
 '''
+import ast
+import collections
+import fractions
+import functools
+import math
+import operator
 import random
 import re
 
+try:
+    import numpy
+except ImportError:  # numpy is only required by the roll_many methods
+    numpy = None
+
 __VERSION__ = "1.2.1"
 
+# maximum number of compiled patterns kept by the pattern cache
+PATTERN_CACHE_SIZE = 256
+
+# maximum number of elementary steps allowed when computing an exact distribution
+MAX_DISTRIBUTION_WORK = 20000000
+
+# maximum number of dice distributions kept by each distribution cache
+DISTRIBUTION_CACHE_SIZE = 128
+
 def compile(pattern_string):  # @ReservedAssignment
     """
     > Similar to xdice.Pattern(pattern_string).compile()
@@ -20,11 +40,39 @@ def compile(pattern_string):  # @ReservedAssignment
     pattern.compile()
     return pattern
 
+def cached_compile(pattern_string):
+    """
+    > Similar to xdice.compile(pattern_string)
+    The compiled Pattern is kept in a bounded LRU cache keyed by the normalized
+    expression, so an expression is only parsed the first time it is seen.
+    The returned Pattern is shared: roll it, but do not compile it again.
+    """
+    if not pattern_string:
+        raise ValueError("Invalid value for 'instr' ('{}')".format(pattern_string))
+    return _compile_normalized(_normalize(pattern_string))
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _compile_normalized(instr):
+    """ internal: the cached part of cached_compile """
+    return compile(instr)
+
+def cache_info():
+    """
+    Returns the statistics of the pattern cache
+    as a named tuple (hits, misses, maxsize, currsize)
+    """
+    return _compile_normalized.cache_info()
+
+def cache_clear():
+    """ Empties the pattern cache and resets its statistics """
+    _compile_normalized.cache_clear()
+
 def roll(pattern_string):
     """
     > Similar to xdice.Pattern(pattern_string).roll()
+    The compiled pattern is taken from the pattern cache (see cached_compile).
     """
-    return Pattern(pattern_string).roll()
+    return cached_compile(pattern_string).roll()
 
 def rolldice(faces, amount=1, drop_lowest=0, drop_highest=0):
     """
@@ -34,10 +82,20 @@ def rolldice(faces, amount=1, drop_lowest=0, drop_highest=0):
 
 _ALLOWED = {'abs': abs, 'max': max, 'min': min}
 
-def _secured_eval(raw):
-    """ securely evaluate the incoming raw string
-    by avoiding the use of any non-allowed function """
-    return eval(raw, {"__builtins__":None}, _ALLOWED)
+_BINARY_OPERATORS = {ast.Add: operator.add,
+                     ast.Sub: operator.sub,
+                     ast.Mult: operator.mul,
+                     ast.Div: operator.truediv,
+                     ast.FloorDiv: operator.floordiv,
+                     ast.Mod: operator.mod}
+
+_UNARY_OPERATORS = {ast.UAdd: operator.pos,
+                    ast.USub: operator.neg}
+
+# the '{i}' fields of a format string are parsed as names 'D<i>'
+# (uppercase, so that they can not collide with the normalized user input)
+_FIELD_RE = re.compile(r"\{(\d+)\}")
+_FIELD_NAME_RE = re.compile(r"D(\d+)$")
 
 def _assert_int_ge_to(value, threshold=0, msg=""):
     """ assert value is an integer greater or equal to threshold """
@@ -58,6 +116,21 @@ def _pop_highest(lst):
     highest = lst.pop(lst.index(max(lst)))
     return highest
 
+def _require_numpy():
+    """ raise an explicit error if numpy is not available """
+    if numpy is None:
+        raise ImportError("numpy is required to roll dice in batches")
+
+def _vector_functions():
+    """ the abs/min/max functions working on numpy arrays """
+    def _reduce(func):
+        def _apply(*args):
+            if len(args) < 2:
+                raise ValueError("min() and max() need at least two arguments with roll_many")
+            return functools.reduce(func, args)
+        return _apply
+    return {'abs': numpy.abs, 'max': _reduce(numpy.maximum), 'min': _reduce(numpy.minimum)}
+
 def _normalize(pattern):
     return str(pattern).replace(" ", "").lower().replace("d%", "d100")
 
@@ -186,6 +259,47 @@ class Dice():
             results += exploded
         return Score(results, dropped, self.name)
 
+    def roll_many(self, n, detail=False, rng=None):
+        """
+        Roll the dice n times at once, with numpy.
+        Return a numpy array of the n totals.
+
+        If detail is True, return a tuple (totals, kept, exploded) where
+        kept is an array (n x kept dice) of the scores which were not dropped, sorted,
+        and exploded is an array of the same shape holding the additional roll
+        triggered by each kept die (0 when the die did not explode).
+
+        rng is the numpy.random.Generator to use (default: a new unseeded generator).
+        The results follow the same rules as roll().
+        """
+        _require_numpy()
+        if rng is None:
+            rng = numpy.random.default_rng()
+        low, high = (-1, 1) if self._sides == "f" else (1, self._sides)
+
+        rolls = rng.integers(low, high + 1, size=(n, self._amount))
+        rolls.sort(axis=1)
+        kept = rolls[:, self._drop_lowest:self._amount - self._drop_highest]
+        totals = kept.sum(axis=1)
+
+        exploded = numpy.zeros_like(kept)
+        if self._explode and self._sides != "f":
+            exploding = kept == self._sides
+            exploded[exploding] = rng.integers(1, self._sides + 1, size=int(exploding.sum()))
+            totals += exploded.sum(axis=1)
+
+        if detail:
+            return totals, kept, exploded
+        return totals
+
+    def distribution(self):
+        """
+        Return the exact Distribution of the score of the dice
+        (memoized by the dice signature)
+        """
+        return _dice_distribution(self._sides, int(self._amount),
+                                  self._drop_lowest, self._drop_highest, bool(self._explode))
+
     @classmethod
     def parse(cls, pattern):
         """ parse a pattern of the form 'xdx', where x are positive integers """
@@ -208,6 +322,83 @@ class Dice():
 
         return Dice(*[sides, int(amount), int(lowest), int(highest), bool(explode)])
 
+class Expression():
+    """
+    Expression(eval_string, functions=None):
+    The arithmetic part of a pattern, parsed once into a tree of closures.
+
+    eval_string is a pattern's format string, where '{i}' stands for the score of the i-th dice.
+    Only numbers, parenthesis, the operators + - * / // %
+    and the functions abs, min and max are accepted: anything else raises a ValueError.
+
+    Calling the expression with the list of scores returns its value.
+    > Eg: Expression('{0}+4-{1}')([3, 2]) => 5
+    """
+    def __init__(self, eval_string, functions=None):
+        """ Parse and compile the expression """
+        self.eval_string = eval_string
+        self.functions = functions or _ALLOWED
+        try:
+            tree = ast.parse(_FIELD_RE.sub(r"D\1", eval_string), mode="eval")
+        except SyntaxError:
+            raise ValueError("Invalid expression ('{}')".format(eval_string))
+        self._evaluate = self._compile(tree.body)
+
+    def __call__(self, scores):
+        """ Evaluate the expression with the given list of scores """
+        return self._evaluate(scores)
+
+    def __repr__(self):
+        """ Return a string representation of the Expression """
+        return "<Expression; {}>".format(self.eval_string)
+
+    def _invalid(self):
+        return ValueError("Invalid expression ('{}')".format(self.eval_string))
+
+    def _compile(self, node):
+        """ internal: recursively turn an ast node into a closure taking the scores list """
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            value = node.value
+            return lambda scores: value
+
+        if isinstance(node, ast.Name):
+            match = _FIELD_NAME_RE.match(node.id)
+            if match is None:
+                raise self._invalid()
+            index = int(match.group(1))
+            return lambda scores: scores[index]
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            # A chain like a+b-c+... (what rX(expr) expands to) nests on its left side:
+            # walk it down and apply the operators in a loop, so that neither compiling
+            # nor evaluating goes one call deeper per operator.
+            steps = []
+            while isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+                steps.append((_BINARY_OPERATORS[type(node.op)], self._compile(node.right)))
+                node = node.left
+            steps.reverse()
+            first = self._compile(node)
+
+            def chain(scores):
+                value = first(scores)
+                for binop, right in steps:
+                    value = binop(value, right(scores))
+                return value
+            return chain
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            unop = _UNARY_OPERATORS[type(node.op)]
+            operand = self._compile(node.operand)
+            return lambda scores: unop(operand(scores))
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in self.functions and node.args and not node.keywords:
+            func = self.functions[node.func.id]
+            args = [self._compile(arg) for arg in node.args]
+            return lambda scores: func(*[arg(scores) for arg in args])
+
+        raise self._invalid()
+
 class Score(int):
     """ Score is a subclass of integer.
     Then you can manipulate it as you would do with an integer.
@@ -299,6 +490,8 @@ class Pattern():
         self.instr = _normalize(instr)
         self.dices = []
         self.format_string = ""
+        self.expression = None
+        self._vector_expression = None
 
     def compile(self):
         """
@@ -311,6 +504,9 @@ class Pattern():
         * pattern.dices
         The list of parsed dice.
         > Eg: '1d6+4+1d4' => [(Dice; sides=6;amount=1), (Dice; sides=4;amount=1)]
+
+        * pattern.expression
+        The Expression compiled from the format string, evaluated at each roll.
         """
         def _submatch(match):
             dice = Dice.parse(match.group(0))
@@ -320,16 +516,60 @@ class Pattern():
 
         expandedstr = Pattern.parse_repeat(self.instr)
         self.format_string = Dice.DICE_RE.sub(_submatch, expandedstr)
+        self.expression = Expression(self.format_string)
 
     def roll(self):
         """
         Compile the pattern if it has not been yet, then roll the dice.
         Return a PatternScore object.
         """
-        if not self.format_string:
+        if self.expression is None:
             self.compile()
         scores = [dice.roll() for dice in self.dices]
-        return PatternScore(self.format_string, scores)
+        return PatternScore(self.format_string, scores, self.expression)
+
+    def roll_many(self, n, detail=False, rng=None):
+        """
+        Compile the pattern if it has not been yet, then roll it n times at once, with numpy.
+        Return a numpy array of the n integer results.
+
+        If detail is True, return a tuple (results, details) where details
+        holds the (totals, kept, exploded) tuple of each dice (see Dice.roll_many).
+
+        rng is the numpy.random.Generator to use (default: a new unseeded generator).
+        The results follow the same rules as roll(), min() and max() need two arguments or more.
+        """
+        _require_numpy()
+        if self.expression is None:
+            self.compile()
+        if self._vector_expression is None:
+            self._vector_expression = Expression(self.format_string, _vector_functions())
+        if rng is None:
+            rng = numpy.random.default_rng()
+
+        details = [dice.roll_many(n, True, rng) for dice in self.dices]
+        with numpy.errstate(divide="raise", invalid="raise"):
+            try:
+                values = self._vector_expression([totals for totals, _, _ in details])
+            except FloatingPointError:
+                raise ZeroDivisionError("division by zero")
+        # same as the int() conversion of a single roll: truncate toward zero
+        results = numpy.broadcast_to(numpy.trunc(values), (n,)).astype(numpy.int64)
+
+        if detail:
+            return results, details
+        return results
+
+    def distribution(self):
+        """
+        Compile the pattern if it has not been yet, then compute
+        the exact Distribution of its results (see Distribution).
+        """
+        if self.expression is None:
+            self.compile()
+        expression = Expression(self.format_string, _DISTRIBUTION_FUNCTIONS)
+        result = expression([dice.distribution() for dice in self.dices])
+        return Distribution.of(result).map(int)
 
     @classmethod
     def parse_repeat(cls, pattern):
@@ -349,8 +589,14 @@ class PatternScore(int):
     Moreover, you can get the list of the scores with the score(i)
     or scores() methods, and retrieve a formatted result with the format() method.
     """
-    def __new__(cls, eval_string, scores):
-        ps = super(PatternScore, cls).__new__(cls, _secured_eval(eval_string.format(*scores)))
+    def __new__(cls, eval_string, scores, expression=None):
+        """
+        expression is the Expression compiled from eval_string,
+        it is compiled here if not given.
+        """
+        if expression is None:
+            expression = Expression(eval_string)
+        ps = super(PatternScore, cls).__new__(cls, expression(scores))
 
         ps._eval_string = eval_string
         ps._scores = scores
@@ -376,3 +622,206 @@ class PatternScore(int):
     def scores(self):
         """ Returns the list of Score objects extracted from the pattern and rolled. """
         return self._scores
+
+
+class Distribution():
+    """
+    Distribution(counts, total):
+    Exact probability distribution of the outcome of some dice.
+
+    counts is a dictionary {outcome: number of cases}, total the number of equally likely cases.
+    Distributions support the arithmetic operators of the patterns, so that
+    the Expression of a Pattern can be evaluated with one distribution per dice.
+
+    eg:
+        >>> d = xdice.compile("2d6").distribution()
+        >>> d.probability(7)
+        Fraction(1, 6)
+        >>> d.at_least(10)
+        Fraction(1, 6)
+        >>> d.mean
+        Fraction(7, 1)
+    """
+    def __init__(self, counts, total):
+        """ Instantiate a Distribution object """
+        self.counts = dict(sorted(counts.items()))
+        self.total = total
+
+    @classmethod
+    def of(cls, value):
+        """ Return value if it is a Distribution, else the distribution of a constant """
+        if isinstance(value, Distribution):
+            return value
+        return cls({value: 1}, 1)
+
+    def __repr__(self):
+        """ Return a string representation of the Distribution """
+        return "<Distribution; outcomes={}; total={}>".format(len(self.counts), self.total)
+
+    def probability(self, value):
+        """ P(X = value) """
+        return fractions.Fraction(self.counts.get(value, 0), self.total)
+
+    def at_least(self, value):
+        """ P(X >= value) """
+        return fractions.Fraction(sum(count for outcome, count in self.counts.items() if outcome >= value),
+                                  self.total)
+
+    def at_most(self, value):
+        """ P(X <= value) """
+        return fractions.Fraction(sum(count for outcome, count in self.counts.items() if outcome <= value),
+                                  self.total)
+
+    def pmf(self):
+        """ Return the probability mass function as a dictionary {outcome: probability} """
+        return {outcome: fractions.Fraction(count, self.total) for outcome, count in self.counts.items()}
+
+    @property
+    def mean(self):
+        """ Expected value """
+        return fractions.Fraction(sum(outcome * count for outcome, count in self.counts.items()), self.total)
+
+    @property
+    def variance(self):
+        """ Variance """
+        mean = self.mean
+        return sum((outcome - mean) ** 2 * count for outcome, count in self.counts.items()) / self.total
+
+    @property
+    def std(self):
+        """ Standard deviation (float) """
+        return math.sqrt(self.variance)
+
+    def format(self, limit=None):
+        """
+        Return a formatted table of the distribution: one line per outcome
+        with P(X = outcome) and P(X >= outcome), as percentages.
+        If limit is given and there are more outcomes, only every n-th outcome is listed.
+        """
+        outcomes = list(self.counts)
+        step = 1 if not limit or len(outcomes) <= limit else math.ceil(len(outcomes) / limit)
+        lines = ["mean: {:.3f}  std: {:.3f}".format(float(self.mean), self.std),
+                 "{:>8} {:>8} {:>8}".format("value", "P(=)", "P(>=)")]
+        remaining = self.total
+        for index, outcome in enumerate(outcomes):
+            if index % step == 0:
+                lines.append("{:>8} {:>7.3f}% {:>7.3f}%".format(outcome,
+                                                                100 * self.counts[outcome] / self.total,
+                                                                100 * remaining / self.total))
+            remaining -= self.counts[outcome]
+        return "\n".join(lines)
+
+    def map(self, func):
+        """ Return the distribution of func(X) """
+        counts = collections.defaultdict(int)
+        for outcome, count in self.counts.items():
+            counts[func(outcome)] += count
+        return Distribution(counts, self.total)
+
+    def combine(self, other, func):
+        """ Return the distribution of func(X, Y), X and Y being independent """
+        other = Distribution.of(other)
+        _check_work(len(self.counts) * len(other.counts))
+        counts = collections.defaultdict(int)
+        for a, count_a in self.counts.items():
+            for b, count_b in other.counts.items():
+                counts[func(a, b)] += count_a * count_b
+        return Distribution(counts, self.total * other.total)
+
+    def _reflected(func):  # @NoSelf
+        """ internal: build the reflected version of an operator """
+        return lambda self, other: Distribution.of(other).combine(self, func)
+
+    __add__ = lambda self, other: self.combine(other, operator.add)
+    __sub__ = lambda self, other: self.combine(other, operator.sub)
+    __mul__ = lambda self, other: self.combine(other, operator.mul)
+    __truediv__ = lambda self, other: self.combine(other, operator.truediv)
+    __floordiv__ = lambda self, other: self.combine(other, operator.floordiv)
+    __mod__ = lambda self, other: self.combine(other, operator.mod)
+    __radd__ = _reflected(operator.add)
+    __rsub__ = _reflected(operator.sub)
+    __rmul__ = _reflected(operator.mul)
+    __rtruediv__ = _reflected(operator.truediv)
+    __rfloordiv__ = _reflected(operator.floordiv)
+    __rmod__ = _reflected(operator.mod)
+    __neg__ = lambda self: self.map(operator.neg)
+    __pos__ = lambda self: self
+    __abs__ = lambda self: self.map(abs)
+    del _reflected
+
+def _check_work(work):
+    """ refuse computations too large to give an answer quickly """
+    if work > MAX_DISTRIBUTION_WORK:
+        raise ValueError("Pattern is too complex to compute its exact distribution")
+
+def _distribution_reduce(func):
+    """ internal: build the min / max functions working on distributions """
+    def _apply(*args):
+        if len(args) < 2:
+            raise ValueError("min() and max() need at least two arguments to compute a distribution")
+        return functools.reduce(lambda a, b: Distribution.of(a).combine(b, func), args)
+    return _apply
+
+_DISTRIBUTION_FUNCTIONS = {'abs': abs, 'max': _distribution_reduce(max), 'min': _distribution_reduce(min)}
+
+def _faces(sides):
+    """ the possible results of a single die """
+    return (-1, 0, 1) if sides == "f" else tuple(range(1, sides + 1))
+
+@functools.lru_cache(maxsize=DISTRIBUTION_CACHE_SIZE)
+def _sum_distribution(faces, amount):
+    """ internal: counts of the sum of 'amount' dice, by repeated polynomial convolution """
+    _check_work(len(faces) ** 2 * amount ** 2)
+    counts = {0: 1}
+    for _ in range(amount):
+        new = collections.defaultdict(int)
+        for subtotal, count in counts.items():
+            for face in faces:
+                new[subtotal + face] += count
+        counts = new
+    return counts
+
+@functools.lru_cache(maxsize=DISTRIBUTION_CACHE_SIZE)
+def _dice_distribution(sides, amount, drop_lowest, drop_highest, explode):
+    """
+    internal: exact distribution of a set of dice.
+
+    Without modifiers this is the plain sum of the dice.
+    Otherwise, the faces are walked from the lowest to the highest while counting
+    how many dice show each face: dice showing one face take the next positions
+    in the sorted results, and only positions [drop_lowest, amount - drop_highest)
+    are kept (order statistics dynamic programming).
+    The state is (dice placed so far, sum of the kept ones).
+    """
+    faces = _faces(sides)
+    explode = explode and sides != "f"
+    if not (drop_lowest or drop_highest or explode):
+        return Distribution(_sum_distribution(faces, amount), len(faces) ** amount)
+
+    _check_work(len(faces) ** 2 * (amount + 1) ** 3)
+    first, last = drop_lowest, amount - drop_highest
+    states = {(0, 0): 1}
+    for face in faces[:-1]:
+        new = collections.defaultdict(int)
+        for (placed, subtotal), count in states.items():
+            for number in range(amount - placed + 1):
+                kept = max(0, min(placed + number, last) - max(placed, first))
+                new[(placed + number, subtotal + kept * face)] += count * math.comb(amount - placed, number)
+        states = new
+
+    # the remaining dice all show the highest face
+    top = faces[-1]
+    counts = collections.defaultdict(int)
+    for (placed, subtotal), count in states.items():
+        kept = max(0, last - max(placed, first))
+        subtotal += kept * top
+        if not explode:
+            counts[subtotal] += count
+            continue
+        # each kept die showing the highest face is rolled once more,
+        # every branch is brought to the common total of len(faces) ** (2 * amount)
+        weight = count * len(faces) ** (amount - kept)
+        for extra, extra_count in _sum_distribution(faces, kept).items():
+            counts[subtotal + extra] += weight * extra_count
+    total = len(faces) ** (2 * amount if explode else amount)
+    return Distribution(counts, total)